@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from PIL import Image
+
+# ============ CACHE DEI RISULTATI CONDIVISA TRA SESSIONI ===============
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Cartella del livello su disco della cache
+CACHE_DIR = os.path.join(ROOT_DIR, ".cache", "artifacts")
+# File con le statistiche della cache, servito da Streamlit (enableStaticServing)
+# all'indirizzo app/static/cache_stats.json
+STATS_FILE = os.path.join(ROOT_DIR, "static", "cache_stats.json")
+# Intervallo minimo (secondi) tra due scritture del file delle statistiche
+STATS_WRITE_INTERVAL = 1.0
+
+# Versione del formato dei risultati: va incrementata ogni volta che cambia il
+# modo in cui viene calcolato un risultato salvato nella cache (es. statistiche
+# zonali, maschere, metriche delle aree)
+CACHE_VERSION = 2
+
+# Budget in byte dei due livelli della cache
+MEMORY_BUDGET = 256 * 1024 * 1024
+DISK_BUDGET = 1024 * 1024 * 1024
+
+# Numero di elementi di un contenitore misurati per stimarne la memoria
+SIZE_SAMPLE = 32
+
+# Valore usato per indicare che un risultato non è presente su disco
+_MISSING = object()
+
+# Funzione che calcola la chiave di un risultato a partire dal tipo (es.
+# "geojson", "mask"), dall'hash del file da cui deriva e dai parametri usati.
+# La chiave contiene anche CACHE_VERSION, così dopo un aggiornamento del codice
+# i risultati salvati su disco con il formato precedente non vengono usati.
+def artifact_key(kind, digest, **params):
+    payload = json.dumps([CACHE_VERSION, kind, digest, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Funzione che stima la memoria occupata da un risultato: visita i contenitori
+# (dict, list, tuple, set), usando nbytes per gli array numpy e la dimensione
+# dei pixel per le immagini PIL. Dei contenitori con più di SIZE_SAMPLE
+# elementi viene misurato solo un campione di elementi equidistanti, così la
+# stima di un GeoJSON con molte aree costa poco. La dimensione serializzata
+# con pickle può essere molto più piccola (es. un GeoJSON con molte
+# coordinate occupa in memoria circa 9 volte i byte serializzati).
+def estimate_size(value, _seen=None):
+    seen = set() if _seen is None else _seen
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if not isinstance(value, (dict, list, tuple, set, frozenset)):
+        return sys.getsizeof(value)
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    elements = [*value.keys(), *value.values()] if isinstance(value, dict) else list(value)
+    size = sys.getsizeof(value)
+    if len(elements) <= SIZE_SAMPLE:
+        return size + sum(estimate_size(element, seen) for element in elements)
+    step = len(elements) / SIZE_SAMPLE
+    sample = [elements[int(i * step)] for i in range(SIZE_SAMPLE)]
+    return size + int(sum(estimate_size(element, seen) for element in sample) * step)
+
+# Classe che implementa una cache indirizzata per contenuto con due livelli:
+# - memoria: i risultati più usati, fino a memory_budget byte
+# - disco: i risultati serializzati con pickle, fino a disk_budget byte
+# Entrambi i livelli usano la politica LRU (viene eliminato il risultato usato
+# meno di recente). In memoria si usa la dimensione stimata con
+# estimate_size(), su disco quella serializzata.
+# I risultati restituiti sono condivisi tra le sessioni e non vanno modificati.
+class ArtifactCache:
+    def __init__(self, cache_dir=CACHE_DIR, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET, stats_file=STATS_FILE):
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.stats_file = stats_file
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._stats = {}
+        self._stats_written_at = 0.0
+        self._lock = threading.Lock()
+        self._load_disk_index()
+
+    # Legge i file già presenti su disco (da esecuzioni precedenti) in ordine
+    # di ultimo utilizzo
+    def _load_disk_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".pkl")]
+        for path in sorted(paths, key=os.path.getmtime):
+            size = os.path.getsize(path)
+            self._disk[os.path.basename(path)[:-4]] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _count(self, kind, event):
+        kind_stats = self._stats.setdefault(kind, {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+        kind_stats[event] += 1
+
+    # Restituisce il risultato associato a (tipo, hash, parametri); se non è
+    # presente in nessun livello viene calcolato con compute() e salvato.
+    def get_or_compute(self, kind, digest, compute, **params):
+        key = artifact_key(kind, digest, **params)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._count(kind, 'memory_hits')
+                value = self._memory[key][0]
+            else:
+                value = _MISSING
+                on_disk = key in self._disk
+        if value is not _MISSING:
+            self._write_stats()
+            return value
+
+        value = self._read_disk(key) if on_disk else _MISSING
+        if value is not _MISSING:
+            with self._lock:
+                self._count(kind, 'disk_hits')
+                self._store_memory(key, value, estimate_size(value))
+            self._write_stats()
+            return value
+
+        value = compute()
+        size = estimate_size(value)
+        with self._lock:
+            self._count(kind, 'misses')
+            self._store_memory(key, value, size)
+        # Un risultato che in memoria supera il budget del disco non viene
+        # serializzato
+        if size <= self.disk_budget:
+            self._write_disk(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        self._write_stats()
+        return value
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), "rb") as cache_file:
+                value = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return _MISSING
+        # Aggiorna la data di ultimo utilizzo per la politica LRU
+        os.utime(self._path(key))
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return value
+
+    # Salva il risultato in memoria eliminando quelli usati meno di recente
+    # finché non si rientra nel budget. I risultati più grandi del budget
+    # rimangono solo su disco.
+    def _store_memory(self, key, value, size):
+        if size > self.memory_budget or key in self._memory:
+            return
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_budget:
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    # Salva il risultato su disco (scrittura atomica tramite file temporaneo)
+    # eliminando i file usati meno di recente oltre il budget
+    def _write_disk(self, key, data):
+        if len(data) > self.disk_budget:
+            return
+        temp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as cache_file:
+                cache_file.write(data)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            return
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+            evicted = []
+            while self._disk_bytes > self.disk_budget and self._disk:
+                evicted_key, evicted_size = self._disk.popitem(last=False)
+                self._disk_bytes -= evicted_size
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            try:
+                os.remove(self._path(evicted_key))
+            except OSError:
+                pass
+
+    # Restituisce le statistiche della cache: per ogni tipo il numero di hit
+    # in memoria e su disco, di miss e la percentuale di hit, più l'occupazione
+    # dei due livelli
+    def stats(self):
+        with self._lock:
+            kinds = {}
+            for kind, kind_stats in sorted(self._stats.items()):
+                hits = kind_stats['memory_hits'] + kind_stats['disk_hits']
+                total = hits + kind_stats['misses']
+                kinds[kind] = {**kind_stats, 'hit_rate': hits / total if total else 0.0}
+            return {
+                'kinds': kinds,
+                'memory': {'entries': len(self._memory), 'bytes': self._memory_bytes, 'budget': self.memory_budget},
+                'disk': {'entries': len(self._disk), 'bytes': self._disk_bytes, 'budget': self.disk_budget},
+            }
+
+    # Scrive le statistiche nel file servito come endpoint di monitoraggio,
+    # al massimo una volta ogni STATS_WRITE_INTERVAL secondi
+    def _write_stats(self):
+        now = time.time()
+        if self.stats_file is None or now - self._stats_written_at < STATS_WRITE_INTERVAL:
+            return
+        self._stats_written_at = now
+        try:
+            os.makedirs(os.path.dirname(self.stats_file), exist_ok=True)
+            temp_path = f"{self.stats_file}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as stats_file:
+                json.dump(self.stats(), stats_file)
+            os.replace(temp_path, self.stats_file)
+        except OSError:
+            pass
+
+# Funzione che restituisce la cache unica del processo, condivisa da tutte
+# le sessioni grazie a st.cache_resource
+@st.cache_resource
+def get_artifact_cache():
+    return ArtifactCache()
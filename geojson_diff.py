@@ -0,0 +1,89 @@
+import hashlib
+import json
+
+# ============ DIFF INCREMENTALE TRA AREE E FILE GEOJSON ===============
+
+# Funzione che calcola l'hash di un oggetto JSON in forma canonica (chiavi
+# ordinate e senza spazi) così che lo stesso contenuto abbia sempre lo stesso hash
+def _json_hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+# Funzione che calcola l'hash del contenuto di un file caricato. Viene usato
+# per capire se il file è cambiato senza confrontare l'intero contenuto.
+def file_digest(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+# Funzione che calcola l'hash del contenuto di un'area (geometria e proprietà)
+def feature_content_hash(feature):
+    return _json_hash([feature.get('geometry'), feature.get('properties')])
+
+# Funzione che restituisce l'identità di un'area, usata per capire se un'area
+# del file corrisponde a un'area già presente. Se l'area ha un 'id' viene usato
+# quello, altrimenti viene usato l'hash della geometria: in questo caso una
+# modifica delle proprietà (es. il nome) risulta come area modificata, mentre
+# una modifica della geometria risulta come area rimossa e area aggiunta.
+def feature_identity(feature):
+    if feature.get('id') is not None:
+        return ('id', str(feature['id']))
+    return ('geometry', _json_hash(feature.get('geometry')))
+
+# Funzione che assegna ad ogni area una chiave univoca (identità, occorrenza):
+# aree con la stessa identità (es. geometrie duplicate) vengono distinte in
+# base all'ordine in cui compaiono
+def _keyed(features):
+    occurrences = {}
+    for feature in features:
+        identity = feature_identity(feature)
+        occurrence = occurrences.get(identity, 0)
+        occurrences[identity] = occurrence + 1
+        yield (identity, occurrence), feature
+
+# Funzione che costruisce l'indice delle aree presenti nella sessione a partire
+# dalle coppie (id, area) della collezione: chiave -> (id, hash del contenuto)
+def build_feature_index(items):
+    items = list(items)
+    index = {}
+    for (key, feature), (feature_id, _) in zip(_keyed(feature for _, feature in items), items):
+        index[key] = (feature_id, feature_content_hash(feature))
+    return index
+
+# Funzione che confronta l'indice delle aree della sessione con le aree del file
+# caricato. Restituisce un dizionario con le aree aggiunte, rimosse e modificate
+# (come liste di chiavi/aree) e il numero di aree rimaste uguali.
+def diff_features(index, features):
+    added, changed = [], []
+    seen = set()
+    for key, feature in _keyed(features):
+        seen.add(key)
+        content_hash = feature_content_hash(feature)
+        if key not in index:
+            added.append((key, feature, content_hash))
+        elif index[key][1] != content_hash:
+            changed.append((key, feature, content_hash))
+    removed = [key for key in index if key not in seen]
+    return {
+        'added': added,
+        'removed': removed,
+        'changed': changed,
+        'unchanged': len(seen) - len(added) - len(changed),
+    }
+
+# Funzione che applica solo le differenze alla collezione di aree, restituendo
+# la nuova versione. Se remove è False le aree non presenti nel file vengono
+# mantenute (modalità unione). L'indice viene aggiornato sul posto, quindi il
+# costo è proporzionale al numero di aree cambiate.
+def apply_diff(store, index, diff, remove=True):
+    if remove:
+        removed_ids = [index.pop(key)[0] for key in diff['removed']]
+        store = store.remove_ids(removed_ids)
+    replaced = {}
+    for key, feature, content_hash in diff['changed']:
+        feature_id = index[key][0]
+        replaced[feature_id] = feature
+        index[key] = (feature_id, content_hash)
+    store = store.replace(replaced)
+    first_id = store.next_id
+    store = store.extend(feature for _, feature, _ in diff['added'])
+    for offset, (key, _, content_hash) in enumerate(diff['added']):
+        index[key] = (first_id + offset, content_hash)
+    return store
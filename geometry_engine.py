@@ -0,0 +1,128 @@
+from functools import lru_cache
+import numpy as np
+from pyproj import CRS, Geod, Transformer
+
+# ============ RIPROIEZIONE E MISURE METRICHE ===============
+
+# CRS geografico usato da GeoJSON e dall'API di MapBox (longitudine, latitudine)
+WGS84 = "EPSG:4326"
+# Ellissoide usato per calcolare le distanze geodetiche in metri
+GEOD = Geod(ellps="WGS84")
+
+# Funzione che converte un CRS (stringa, codice EPSG o oggetto pyproj) in una
+# stringa normalizzata, usata come chiave della cache dei transformer
+def crs_key(crs):
+    if crs is None:
+        return WGS84
+    return CRS.from_user_input(crs).to_string()
+
+# Funzione che restituisce il transformer tra due CRS. Creare un transformer è
+# costoso, quindi ne viene mantenuto uno per ogni coppia di CRS.
+# always_xy=True mantiene l'ordine (x, y) = (longitudine, latitudine).
+@lru_cache(maxsize=32)
+def get_transformer(src_crs, dst_crs):
+    return Transformer.from_crs(CRS.from_user_input(src_crs), CRS.from_user_input(dst_crs), always_xy=True)
+
+# Funzione che riproietta tutte le coordinate con una sola chiamata vettorizzata
+# sugli array piatti di x e y
+def reproject(xs, ys, src_crs, dst_crs):
+    src_crs, dst_crs = crs_key(src_crs), crs_key(dst_crs)
+    if src_crs == dst_crs:
+        return xs, ys
+    new_xs, new_ys = get_transformer(src_crs, dst_crs).transform(xs, ys)
+    return np.asarray(new_xs, dtype=float), np.asarray(new_ys, dtype=float)
+
+# Funzione che converte le features (Polygon o MultiPolygon) in array piatti:
+# - 'x', 'y': coordinate di tutti i vertici di tutti gli anelli
+# - 'ring_start', 'ring_length': inizio e numero di vertici di ogni anello
+# - 'ring_feature': indice della feature a cui appartiene ogni anello
+# - 'ring_exterior': True se l'anello è un contorno esterno, False se è un buco
+# - 'outline_mask': vertici dei contorni esterni senza il vertice di chiusura
+def flatten_features(features):
+    xs, ys, outline = [], [], []
+    ring_start, ring_length, ring_feature, ring_exterior = [], [], [], []
+    for feature_index, feature in enumerate(features):
+        geometry = feature['geometry']
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        for polygon in polygons:
+            for ring_index, ring in enumerate(polygon):
+                ring_start.append(len(xs))
+                ring_length.append(len(ring))
+                ring_feature.append(feature_index)
+                ring_exterior.append(ring_index == 0)
+                closed = len(ring) > 1 and ring[0] == ring[-1]
+                for vertex_index, coord in enumerate(ring):
+                    xs.append(coord[0])
+                    ys.append(coord[1])
+                    outline.append(ring_index == 0 and not (closed and vertex_index == len(ring) - 1))
+    return {
+        'x': np.asarray(xs, dtype=float),
+        'y': np.asarray(ys, dtype=float),
+        'ring_start': np.asarray(ring_start, dtype=np.int64),
+        'ring_length': np.asarray(ring_length, dtype=np.int64),
+        'ring_feature': np.asarray(ring_feature, dtype=np.int64),
+        'ring_exterior': np.asarray(ring_exterior, dtype=bool),
+        'outline_mask': np.asarray(outline, dtype=bool),
+    }
+
+# Funzione che restituisce, per ogni segmento di ogni anello (compreso quello
+# di chiusura tra ultimo e primo vertice), gli indici dei due estremi e
+# l'indice dell'anello a cui appartiene
+def _ring_segments(flat):
+    lengths = flat['ring_length']
+    ring_ids = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.arange(len(ring_ids))
+    ends = starts + 1
+    # L'ultimo vertice di ogni anello si collega al primo dello stesso anello
+    last = flat['ring_start'] + lengths - 1
+    ends[last[lengths > 0]] = flat['ring_start'][lengths > 0]
+    return starts, ends, ring_ids
+
+# Funzione che calcola area (m²) e perimetro (m) di ogni feature.
+# Le coordinate vengono riproiettate in WGS84 con una sola chiamata; il
+# perimetro è la somma delle distanze geodetiche dei segmenti, l'area viene
+# calcolata con la formula di Gauss (shoelace) in una proiezione equivalente
+# (Lambert Azimutale Equivalente) centrata sulle aree, che conserva le aree.
+# Le somme per anello e per feature sono fatte con np.bincount.
+def feature_metrics(flat, src_crs, n_features):
+    if len(flat['x']) == 0:
+        return np.zeros(n_features), np.zeros(n_features)
+    lon, lat = reproject(flat['x'], flat['y'], src_crs, WGS84)
+    starts, ends, ring_ids = _ring_segments(flat)
+    n_rings = len(flat['ring_length'])
+
+    _, _, distances = GEOD.inv(lon[starts], lat[starts], lon[ends], lat[ends])
+    ring_perimeter = np.bincount(ring_ids, weights=distances, minlength=n_rings)
+
+    laea = f"+proj=laea +lat_0={np.mean(lat)} +lon_0={np.mean(lon)} +datum=WGS84 +units=m"
+    x, y = reproject(lon, lat, WGS84, laea)
+    cross = x[starts] * y[ends] - x[ends] * y[starts]
+    ring_area = np.abs(np.bincount(ring_ids, weights=cross, minlength=n_rings)) / 2
+    # I buchi vengono sottratti dall'area del contorno esterno
+    signed_area = np.where(flat['ring_exterior'], ring_area, -ring_area)
+
+    areas = np.bincount(flat['ring_feature'], weights=signed_area, minlength=n_features)
+    perimeters = np.bincount(flat['ring_feature'], weights=ring_perimeter, minlength=n_features)
+    return areas, perimeters
+
+# Funzione che raggruppa area e perimetro per classe (nome dell'area).
+# Restituisce le classi ordinate, il numero di aree, l'area e il perimetro totali.
+def class_metrics(names, areas, perimeters):
+    classes, codes = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+    counts = np.bincount(codes, minlength=len(classes))
+    class_areas = np.bincount(codes, weights=areas, minlength=len(classes))
+    class_perimeters = np.bincount(codes, weights=perimeters, minlength=len(classes))
+    return classes, counts, class_areas, class_perimeters
+
+# Funzione che calcola la risoluzione spaziale esatta (metri per pixel) di
+# un'immagine che copre il bounding box indicato in WGS84, usando le distanze
+# geodetiche lungo il parallelo e il meridiano centrali
+def metric_resolution(bbox, width, height):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    center_lat = (min_lat + max_lat) / 2
+    center_lon = (min_lon + max_lon) / 2
+    _, _, lon_distance = GEOD.inv(min_lon, center_lat, max_lon, center_lat)
+    _, _, lat_distance = GEOD.inv(center_lon, min_lat, center_lon, max_lat)
+    resolution_lat = lat_distance / height
+    resolution_lon = lon_distance / width
+    return resolution_lat, resolution_lon, resolution_lat * resolution_lon
@@ -0,0 +1,215 @@
+from collections import deque
+
+# ============ COLLEZIONE PERSISTENTE DI AREE ===============
+
+# Numero di bit usati per ogni livello del trie: ogni nodo ha 32 figli
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+# Funzione che restituisce una copia del nodo con il valore associato alla
+# chiave sostituito. Vengono copiati solo i nodi lungo il percorso dalla radice
+# alla foglia (path copying), tutti gli altri nodi sono condivisi con la
+# versione precedente. Se il valore è None e il ramo non esiste non viene
+# creato nulla.
+def _assoc(node, shift, key, value):
+    if node is None:
+        if value is None:
+            return None
+        node = (None,) * WIDTH
+    index = (key >> shift) & MASK
+    children = list(node)
+    if shift == 0:
+        children[index] = value
+    else:
+        children[index] = _assoc(node[index], shift - BITS, key, value)
+    return tuple(children)
+
+# Funzione che cerca il valore associato alla chiave scendendo nel trie
+def _lookup(node, shift, key):
+    while node is not None and shift > 0:
+        node = node[(key >> shift) & MASK]
+        shift -= BITS
+    if node is None:
+        return None
+    return node[key & MASK]
+
+# Funzione che scorre ricorsivamente il trie in ordine di chiave e restituisce
+# le coppie (chiave, area) saltando gli slot vuoti
+def _iter_node(node, shift, base):
+    if node is None:
+        return
+    for index, child in enumerate(node):
+        if child is None:
+            continue
+        key = base | (index << shift)
+        if shift == 0:
+            yield key, child
+        else:
+            yield from _iter_node(child, shift - BITS, key)
+
+# Classe immutabile che contiene la lista di aree disegnate o importate.
+# Internamente è un trie con 32 figli per nodo indicizzato da un id crescente
+# assegnato ad ogni area: aggiungere o cancellare k aree crea una nuova versione
+# in O(k log n) condividendo tutto il resto della struttura con quella precedente.
+# In questo modo la cronologia può mantenere molte versioni senza copiare
+# l'intera lista ad ogni operazione.
+class FeatureStore:
+    __slots__ = ('_root', '_shift', '_next_id', '_count')
+
+    def __init__(self, root=None, shift=0, next_id=0, count=0):
+        self._root = root
+        self._shift = shift
+        self._next_id = next_id
+        self._count = count
+
+    # Costruisce una collezione a partire da una lista di aree creando
+    # direttamente i nodi foglia e poi i livelli superiori (O(n))
+    @classmethod
+    def from_features(cls, features):
+        nodes = [tuple(features[i:i + WIDTH]) for i in range(0, len(features), WIDTH)]
+        if not nodes:
+            return cls()
+        nodes = [node + (None,) * (WIDTH - len(node)) for node in nodes]
+        shift = 0
+        while len(nodes) > 1:
+            nodes = [tuple(nodes[i:i + WIDTH]) for i in range(0, len(nodes), WIDTH)]
+            nodes = [node + (None,) * (WIDTH - len(node)) for node in nodes]
+            shift += BITS
+        return cls(nodes[0], shift, len(features), len(features))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for _, feature in self.items():
+            yield feature
+
+    # Restituisce le coppie (id, area) in ordine di inserimento
+    def items(self):
+        return _iter_node(self._root, self._shift, 0)
+
+    # Id che verrà assegnato alla prossima area aggiunta
+    @property
+    def next_id(self):
+        return self._next_id
+
+    def get(self, feature_id):
+        if feature_id < 0 or feature_id >= self._next_id:
+            return None
+        return _lookup(self._root, self._shift, feature_id)
+
+    # Restituisce una nuova versione con l'area aggiunta in fondo. Se il trie
+    # è pieno viene aggiunto un livello sopra la radice attuale.
+    def append(self, feature):
+        root, shift = self._root, self._shift
+        key = self._next_id
+        if key >= 1 << (shift + BITS):
+            root = (root,) + (None,) * (WIDTH - 1)
+            shift += BITS
+        root = _assoc(root, shift, key, feature)
+        return FeatureStore(root, shift, key + 1, self._count + 1)
+
+    # Restituisce una nuova versione con tutte le aree aggiunte in fondo.
+    # Le nuove aree ricevono gli id da next_id in poi.
+    def extend(self, features):
+        store = self
+        for feature in features:
+            store = store.append(feature)
+        return store
+
+    # Restituisce una nuova versione in cui le aree con gli id indicati
+    # (dizionario id -> area) sono sostituite con quelle nuove
+    def replace(self, features_by_id):
+        root = self._root
+        for feature_id, feature in features_by_id.items():
+            if self.get(feature_id) is not None:
+                root = _assoc(root, self._shift, feature_id, feature)
+        if root is self._root:
+            return self
+        return FeatureStore(root, self._shift, self._next_id, self._count)
+
+    # Restituisce una nuova versione senza le aree con gli id indicati
+    def remove_ids(self, feature_ids):
+        root, count = self._root, self._count
+        for feature_id in set(feature_ids):
+            if self.get(feature_id) is not None:
+                root = _assoc(root, self._shift, feature_id, None)
+                count -= 1
+        if count == self._count:
+            return self
+        return FeatureStore(root, self._shift, self._next_id, count)
+
+    # Restituisce una nuova versione senza le aree che soddisfano la condizione
+    def remove_where(self, predicate):
+        return self.remove_ids([feature_id for feature_id, feature in self.items() if predicate(feature)])
+
+    # Converte la collezione nella lista di aree usata dal resto della pagina
+    def to_list(self):
+        return list(self)
+
+# ============ CRONOLOGIA ANNULLA/RIPETI ===============
+
+# Classe che memorizza le versioni della collezione di aree per permettere
+# di annullare e ripetere le operazioni. Ogni elemento della cronologia è una
+# coppia (descrizione operazione, versione precedente); dato che le versioni
+# condividono la struttura, ogni passo occupa memoria solo per le aree cambiate.
+# La profondità massima indica quante operazioni possono essere annullate.
+class DrawingsHistory:
+    def __init__(self, max_depth=50, store=None):
+        self.current = store if store is not None else FeatureStore()
+        self._undo = deque(maxlen=max_depth)
+        self._redo = []
+
+    @property
+    def max_depth(self):
+        return self._undo.maxlen
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    # Descrizione dell'operazione che verrebbe annullata o ripetuta
+    @property
+    def undo_label(self):
+        return self._undo[-1][0] if self._undo else None
+
+    @property
+    def redo_label(self):
+        return self._redo[-1][0] if self._redo else None
+
+    # Cambia la profondità massima mantenendo le operazioni più recenti
+    def set_max_depth(self, max_depth):
+        if max_depth != self._undo.maxlen:
+            self._undo = deque(self._undo, maxlen=max_depth)
+
+    # Salva una nuova versione come versione corrente. Se la versione non è
+    # cambiata (o se sono entrambe vuote) non viene aggiunto nulla alla
+    # cronologia e viene restituito False.
+    def commit(self, store, label):
+        if store is self.current or (len(store) == 0 and len(self.current) == 0):
+            return False
+        self._undo.append((label, self.current))
+        self._redo.clear()
+        self.current = store
+        return True
+
+    def undo(self):
+        if not self._undo:
+            return False
+        label, store = self._undo.pop()
+        self._redo.append((label, self.current))
+        self.current = store
+        return True
+
+    def redo(self):
+        if not self._redo:
+            return False
+        label, store = self._redo.pop()
+        self._undo.append((label, self.current))
+        self.current = store
+        return True
@@ -0,0 +1,202 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from io import BytesIO
+import streamlit as st
+import streamlit.components.v1 as components
+from PIL import features
+
+# ============ INVIO EFFICIENTE DELLE IMMAGINI AL BROWSER ===============
+
+# Cartella (servita da Streamlit con server.enableStaticServing) in cui vengono
+# salvate le immagini codificate, con il relativo percorso URL. Il percorso è
+# relativo alla pagina, così funziona anche con server.baseUrlPath.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "comparison")
+STATIC_URL = "app/static/comparison"
+# Numero massimo di immagini mantenute nella cartella statica
+MAX_STATIC_FILES = 200
+# Età minima (secondi dall'ultimo utilizzo) di un'immagine prima che possa
+# essere cancellata, così il browser di un'altra sessione ha il tempo di scaricarla
+MIN_STATIC_FILE_AGE = 600
+# Lock che protegge la cartella statica, condivisa da tutte le sessioni del processo
+_static_lock = threading.Lock()
+
+MIME_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+# Funzione che calcola l'hash del contenuto (pixel, modalità e dimensioni)
+# di un'immagine PIL, usato come chiave della cache delle immagini codificate
+def image_digest(image):
+    digest = hashlib.sha1(f"{image.mode}{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+# Funzione che restituisce il formato da usare: se Pillow non supporta WebP
+# viene usato JPEG
+def supported_format(image_format):
+    if image_format == "WEBP" and not features.check("webp"):
+        return "JPEG"
+    return image_format
+
+# Funzione che codifica l'immagine nel formato e qualità indicati,
+# eventualmente ridimensionandola (anteprima). Il risultato viene messo in
+# cache usando l'hash del contenuto: l'immagine (_image) non viene usata come
+# chiave per evitare di serializzarla ad ogni rerun.
+# Restituisce il nome del file (hash dei byte codificati), i byte e il data URL.
+@st.cache_data(max_entries=64, show_spinner=False)
+def encode_image(digest, _image, image_format, quality, max_side=None):
+    image = _image.convert("RGB")
+    if max_side is not None and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    data = buffer.getvalue()
+    name = hashlib.sha1(data).hexdigest()[:20]
+    data_url = f"data:{MIME_TYPES[image_format]};base64,{base64.b64encode(data).decode('utf-8')}"
+    return name, data, data_url
+
+# Funzione che cancella le immagini meno recenti se nella cartella statica ci
+# sono troppi file. Non vengono cancellate le immagini usate negli ultimi
+# MIN_STATIC_FILE_AGE secondi. Gli errori (es. file già cancellato) vengono
+# ignorati. Va chiamata tenendo _static_lock.
+def _evict_static_files():
+    files = []
+    for file_name in os.listdir(STATIC_DIR):
+        path = os.path.join(STATIC_DIR, file_name)
+        try:
+            files.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    files.sort()
+    oldest_allowed = time.time() - MIN_STATIC_FILE_AGE
+    for modified_at, path in files[:max(0, len(files) - MAX_STATIC_FILES + 1)]:
+        if modified_at > oldest_allowed:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Funzione che salva l'immagine codificata nella cartella statica (se non è
+# già presente) e ne restituisce l'URL. Dato che il nome del file è l'hash
+# del contenuto, il browser può tenere in cache le immagini già scaricate.
+# Il file viene scritto in un file temporaneo e poi rinominato, così non viene
+# mai servito un file scritto a metà. Se il file esiste già viene aggiornata la
+# data di ultimo utilizzo.
+def _static_source(name, data, image_format):
+    file_name = f"{name}.{image_format.lower()}"
+    path = os.path.join(STATIC_DIR, file_name)
+    with _static_lock:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(STATIC_DIR, exist_ok=True)
+            _evict_static_files()
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as image_file:
+                image_file.write(data)
+            os.replace(temp_path, path)
+    return f"{STATIC_URL}/{file_name}"
+
+# Funzione che restituisce la sorgente (src) da usare nell'HTML per
+# l'immagine: un URL della cartella statica se il servizio di file statici è
+# attivo, altrimenti un data URL base64
+def image_source(image, image_format="WEBP", quality=85, max_side=None):
+    image_format = supported_format(image_format)
+    name, data, data_url = encode_image(image_digest(image), image, image_format, quality, max_side)
+    if st.get_option("server.enableStaticServing"):
+        return _static_source(name, data, image_format)
+    return data_url
+
+# Funzione che crea il codice HTML dello slider di confronto (libreria
+# juxtapose, la stessa usata da streamlit_image_comparison).
+# Se sono indicate le sorgenti complete (full_sources), lo slider viene creato
+# con le sorgenti src1 e src2 (anteprime) e le immagini complete vengono
+# scaricate in background: appena un'immagine è stata scaricata l'anteprima
+# viene sostituita (juxtapose la usa come src di un img o come sfondo).
+def _comparison_html(src1, src2, label1, label2, width, height, starting_position, show_labels, make_responsive,
+                     full_sources=None):
+    cdn_path = "https://cdn.knightlab.com/libs/juxtapose/latest"
+    return f"""
+        <style>body {{ margin: unset; }}</style>
+        <link rel="stylesheet" href="{cdn_path}/css/juxtapose.css">
+        <script src="{cdn_path}/js/juxtapose.min.js"></script>
+        <div id="foo" style="height: {height}; width: {width or '100%'};"></div>
+        <script>
+        slider = new juxtapose.JXSlider('#foo',
+            [
+                {{
+                    src: '{src1}',
+                    label: '{label1}',
+                }},
+                {{
+                    src: '{src2}',
+                    label: '{label2}',
+                }}
+            ],
+            {{
+                animate: true,
+                showLabels: {'true' if show_labels else 'false'},
+                showCredits: true,
+                startingPosition: "{starting_position}%",
+                makeResponsive: {'true' if make_responsive else 'false'},
+            }});
+        </script>
+        {_preview_swap_script(dict(zip((src1, src2), full_sources))) if full_sources else ""}
+        """
+
+# Funzione che crea lo script che sostituisce le anteprime con le immagini
+# complete. Se lo slider non è ancora stato costruito quando l'immagine
+# completa è pronta, la sostituzione viene ritentata ogni 100 ms.
+def _preview_swap_script(full_by_preview):
+    return f"""
+        <script>
+        const fullByPreview = {json.dumps({preview: full for preview, full in full_by_preview.items() if preview != full})};
+        function swapPreview(preview, full, attempts) {{
+            let swapped = false;
+            document.querySelectorAll('#foo *').forEach((element) => {{
+                if (element.tagName === 'IMG' && element.getAttribute('src') === preview) {{
+                    element.src = full;
+                    swapped = true;
+                }} else if (element.style.backgroundImage.includes(preview)) {{
+                    element.style.backgroundImage = 'url("' + full + '")';
+                    swapped = true;
+                }}
+            }});
+            if (!swapped && attempts > 0) {{
+                setTimeout(() => swapPreview(preview, full, attempts - 1), 100);
+            }}
+        }}
+        Object.entries(fullByPreview).forEach(([preview, full]) => {{
+            const loader = new Image();
+            loader.onload = () => swapPreview(preview, full, 100);
+            loader.src = full;
+        }});
+        </script>
+        """
+
+# Funzione che mostra lo slider di confronto tra due immagini PIL, sostituendo
+# image_comparison(..., in_memory=True) che ricodificava e inviava le immagini
+# a piena risoluzione ad ogni rerun.
+# Le immagini vengono codificate una sola volta (WebP o JPEG con la qualità
+# indicata). Lo slider viene mostrato subito con anteprime a bassa risoluzione
+# (lato massimo preview_side) che il browser sostituisce con le immagini
+# complete appena sono state scaricate. Se le immagini non cambiano, l'HTML
+# generato è identico e le immagini non vengono inviate di nuovo al browser.
+def comparison_slider(img1, img2, label1="1", label2="2", width=580, starting_position=50,
+                      show_labels=True, make_responsive=True, image_format="WEBP", quality=85, preview_side=256):
+    img_width, img_height = img1.size
+    height = int((width * img_height / img_width) * 0.95)
+
+    full_sources = (image_source(img1, image_format, quality), image_source(img2, image_format, quality))
+    if preview_side is None:
+        html = _comparison_html(*full_sources, label1, label2, width, height, starting_position, show_labels,
+                                make_responsive)
+    else:
+        html = _comparison_html(image_source(img1, image_format, 50, preview_side),
+                                image_source(img2, image_format, 50, preview_side),
+                                label1, label2, width, height, starting_position, show_labels, make_responsive,
+                                full_sources=full_sources)
+    components.html(html, height=height, width=width)
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# ============ ESECUZIONE DI LAVORI IN BACKGROUND ===============
+
+# Numero massimo di lavori eseguiti contemporaneamente (da tutte le sessioni)
+MAX_WORKERS = 4
+# Numero massimo di lavori terminati di cui vengono mantenuti i risultati
+MAX_FINISHED_JOBS = 128
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Eccezione sollevata all'interno di un lavoro quando ne viene richiesto
+# l'annullamento
+class JobCancelled(Exception):
+    pass
+
+# Funzione che calcola la chiave di un lavoro a partire dal nome e dagli input:
+# lavori con gli stessi input hanno la stessa chiave e vengono eseguiti una volta sola
+def job_key(name, *args):
+    payload = json.dumps([name, *args], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Classe che rappresenta un lavoro in background. La funzione eseguita riceve
+# il lavoro come primo argomento, così può aggiornare l'avanzamento con
+# set_progress() e controllare se è stato annullato con check_cancelled().
+class Job:
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+        self.status = PENDING
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.future = None
+        self.finished_at = None
+        # Sessioni che hanno richiesto il lavoro e sessioni che lo stanno
+        # ancora aspettando (non lo hanno annullato)
+        self.requested_by = set()
+        self.waiters = set()
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    # Indica se è stato richiesto l'annullamento del lavoro (anche se il
+    # thread non se ne è ancora accorto)
+    @property
+    def cancelling(self):
+        return self._cancel_event.is_set()
+
+    def set_progress(self, progress, message=""):
+        self.progress = min(max(progress, 0.0), 1.0)
+        self.message = message
+        self.check_cancelled()
+
+    # Indica se il lavoro è stato annullato per la sessione indicata: o è stato
+    # annullato davvero oppure la sessione lo ha annullato mentre altre
+    # sessioni lo stanno ancora aspettando
+    def cancelled_for(self, waiter):
+        if self.status == CANCELLED:
+            return True
+        return not self.finished and waiter in self.requested_by and waiter not in self.waiters
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        self._cancel_event.set()
+        # Se il lavoro non è ancora partito viene tolto dalla coda
+        if self.future is not None and self.future.cancel():
+            self._finish(CANCELLED)
+
+    def _finish(self, status, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.status = status
+        self.finished_at = time.time()
+
+# Classe che esegue i lavori in un pool di thread condiviso tra tutte le
+# sessioni. I lavori sono identificati dalla chiave calcolata sugli input: se
+# un lavoro con la stessa chiave è già in corso o terminato con successo viene
+# restituito quello invece di eseguirlo di nuovo, anche per utenti diversi.
+# I lavori terminati vengono mantenuti (fino a MAX_FINISHED_JOBS) così un
+# rerun successivo può riprenderne il risultato senza bloccare la pagina.
+# Ogni lavoro tiene traccia delle sessioni (waiter) che lo aspettano: un
+# annullamento ferma il lavoro solo quando non lo aspetta più nessuno.
+class JobExecutor:
+    def __init__(self, max_workers=MAX_WORKERS, max_finished_jobs=MAX_FINISHED_JOBS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_finished_jobs = max_finished_jobs
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    # Avvia il lavoro se non esiste già, registrando la sessione (waiter) che
+    # lo richiede. Un lavoro fallito o annullato (o in corso di annullamento)
+    # con la stessa chiave viene eseguito di nuovo se lo richiede una sessione
+    # che non ne ha ancora visto l'esito oppure con restart=True (es. pulsante
+    # "Riprova"). Con
+    # restart=True la sessione torna ad aspettare un lavoro ancora in corso
+    # che aveva annullato.
+    def submit(self, key, label, fn, *args, waiter=None, restart=False):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                retry = ((job.status in (FAILED, CANCELLED) or job.cancelling) and
+                         (restart or waiter not in job.requested_by))
+                if not retry:
+                    if not job.finished and (restart or waiter not in job.requested_by):
+                        job.waiters.add(waiter)
+                    job.requested_by.add(waiter)
+                    self._jobs.move_to_end(key)
+                    return job
+            job = Job(key, label)
+            job.requested_by.add(waiter)
+            job.waiters.add(waiter)
+            self._jobs[key] = job
+            self._evict()
+            job.future = self._pool.submit(self._run, job, fn, args)
+            return job
+
+    # Toglie la sessione da quelle che aspettano il lavoro e lo annulla solo
+    # se non lo aspetta più nessuna sessione. L'annullamento avviene tenendo il
+    # lock, così nessuna sessione può unirsi a un lavoro che sta per essere annullato.
+    def cancel(self, key, waiter=None):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.finished:
+                return
+            job.waiters.discard(waiter)
+            if not job.waiters:
+                job.cancel()
+
+    def _run(self, job, fn, args):
+        job.status = RUNNING
+        try:
+            job.check_cancelled()
+            job._finish(DONE, result=fn(job, *args))
+        except JobCancelled:
+            job._finish(CANCELLED)
+        except Exception as error:
+            job._finish(FAILED, error=error)
+
+    # Rimuove i lavori terminati meno recenti se sono troppi
+    def _evict(self):
+        finished = [key for key, job in self._jobs.items() if job.finished]
+        for key in finished[:max(0, len(finished) - self._max_finished_jobs)]:
+            del self._jobs[key]
+
+# Funzione che restituisce l'identificativo della sessione Streamlit corrente,
+# usato come waiter dei lavori
+def session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+# Funzione che restituisce l'executor unico del processo, condiviso da tutte
+# le sessioni grazie a st.cache_resource
+@st.cache_resource
+def get_executor():
+    return JobExecutor()
+
+# Funzione che mostra l'avanzamento di un lavoro non ancora terminato con un
+# pulsante per annullarlo (solo per la sessione corrente). Il frammento viene rieseguito ogni secondo e,
+# quando il lavoro termina, viene fatto un rerun della pagina per mostrarne
+# il risultato. Il resto della pagina non viene eseguito finché il lavoro
+# non è terminato.
+def wait_for_job(job):
+    @st.fragment(run_every=1)
+    def job_progress():
+        if job.finished:
+            st.rerun()
+        st.progress(job.progress, text=job.message or job.label)
+        if st.button("Annulla", key=f"cancel_{job.key}"):
+            get_executor().cancel(job.key, session_id())
+            st.rerun()
+
+    job_progress()
+    st.stop()
+
+# Funzione che esegue in background il lavoro con la chiave indicata (se non è
+# già in corso o terminato) e ne restituisce il risultato. Finché il lavoro non
+# è terminato ne viene mostrato l'avanzamento e il resto della pagina non viene
+# eseguito. Se il lavoro è stato annullato o è fallito viene mostrato il
+# messaggio corrispondente (error_message può contenere {error}) con un
+# pulsante per riprovare, e viene restituito None.
+def run_job(key, label, fn, *args, cancelled_message="Operazione annullata.",
+            error_message="Errore durante l'operazione: {error}"):
+    executor = get_executor()
+    waiter = session_id()
+    job = executor.submit(key, label, fn, *args, waiter=waiter)
+    if job.status == DONE:
+        return job.result
+    if job.cancelled_for(waiter):
+        st.warning(cancelled_message)
+    elif job.finished:
+        st.error(error_message.format(error=job.error))
+    else:
+        wait_for_job(job)
+    if st.button("Riprova", key=f"retry_{key}"):
+        executor.submit(key, label, fn, *args, waiter=waiter, restart=True)
+        st.rerun()
+    return None
@@ -4,15 +4,21 @@ import leafmap.foliumap as leafmap
 import folium
 from folium.plugins import Draw
 import json
+import copy
 from geojson import Feature, FeatureCollection
 from utils import *
+from history import FeatureStore, DrawingsHistory
+from validation import validate_drawings, validate_appended, validate_changes
+from geojson_diff import file_digest, build_feature_index, diff_features, apply_diff
+from artifact_cache import get_artifact_cache
 
 # ============ DICHIARAZIONE E DEFINIZIONE DI FUNZIONI ===============
 
 # Funzione che viene chiamata all'inizio del corpo principale del codice 
 # per inizializzare i valori iniziali come latitudine e longitudine (coordinate
 # U14 Milano Bicocca), livello di zoom mappa, lista di aree/disegni e stato del
-# toggle nelle opzioni mappa
+# toggle nelle opzioni mappa. Inizializza anche la cronologia delle operazioni
+# sulle aree usata dai pulsanti Annulla/Ripeti
 def initialize_session_state():
     if 'lat' not in st.session_state:
         st.session_state.lat = 45.523840041350965
@@ -30,6 +36,13 @@ def initialize_session_state():
         st.session_state.options = ["Acqua", "Campo Agricolo", "Edificio", "Strada", "Vegetazione"]
     if 'last_name_selected' not in st.session_state:
         st.session_state.last_name_selected = "Acqua"
+    if 'history_depth' not in st.session_state:
+        st.session_state.history_depth = 50
+    if 'history' not in st.session_state:
+        st.session_state.history = DrawingsHistory(st.session_state.history_depth,
+                                                   FeatureStore.from_features(st.session_state.drawings))
+    if 'validation' not in st.session_state:
+        st.session_state.validation = validate_drawings(st.session_state.drawings)
 
 # Funzione per creare mappa con il modulo foliumap di leafmap sulla quale
 # viene applicato il basemap satellite e l'interfaccia di disegno per 
@@ -93,8 +106,11 @@ def create_map():
 # per cambiare il colore dell'area quando questa viene selezionata/deselezionata.
 # Per aggiungere i geojson alla mappa scorre la lista dei disegni inseriti ed estrae
 # le loro proprietà assegnando il colore se sono selezionate o meno.
+# Le aree non valide (autointersecanti o sovrapposte ad altre aree) vengono
+# evidenziate in arancione.
 def add_geojson_to_map(drawings, m):
-    for drawing in drawings:
+    invalid_indexes = st.session_state.validation['invalid']
+    for index, drawing in enumerate(drawings):
         # Verifica se il disegno ha la proprietà 'properties'
         if 'properties' in drawing:
             properties = drawing['properties']
@@ -111,6 +127,17 @@ def add_geojson_to_map(drawings, m):
                             'weight': 2
                             }
                     ).add_to(m)
+                elif index in invalid_indexes:
+                    folium.GeoJson(
+                        drawing,
+                        tooltip=popup_text,
+                        style_function=lambda x: {
+                            'fillColor': 'orange',
+                            'color': 'orange',
+                            'weight': 3,
+                            'dashArray': '5, 5'
+                            }
+                    ).add_to(m)
                 else:
                     folium.GeoJson(
                         drawing,
@@ -126,16 +153,14 @@ def add_geojson_to_map(drawings, m):
 # mappa o quando viene inserito un file tramite il pulsante di import. Questo perchè
 # la mappa deve contenere tutte le aree disegnate in modo da farle inizialmente
 # vedere tutte all'utente.
-@st.cache_data
-def calculate_bounds(drawings):
-    all_coords = []
-    for drawing in drawings:
-        for polygon in drawing['geometry']['coordinates']:
-            all_coords.extend(polygon)
-    min_lon = min(coord[0] for coord in all_coords)
-    max_lon = max(coord[0] for coord in all_coords)
-    min_lat = min(coord[1] for coord in all_coords)
-    max_lat = max(coord[1] for coord in all_coords)
+# Vengono usati i bounding box delle aree già calcolati dalla validazione
+# topologica, così non vengono rilette tutte le coordinate.
+def calculate_bounds(boxes):
+    boxes = [box for box in boxes if box is not None]
+    min_lon = min(box[0] for box in boxes)
+    max_lon = max(box[2] for box in boxes)
+    min_lat = min(box[1] for box in boxes)
+    max_lat = max(box[3] for box in boxes)
     return [[min_lat, min_lon], [max_lat, max_lon]]
 
 # Dialog che viene aperto ogni volta in cui viene selezionata un'area geografica
@@ -171,14 +196,60 @@ def set_info_area(last_drawing, st_component):
         update_session_state(last_drawing, st_component)
         st.rerun()
 
+# Funzione che salva una nuova versione delle aree nella cronologia e aggiorna
+# la lista di aree nel session state. La descrizione viene mostrata
+# nei pulsanti Annulla/Ripeti. Ad ogni modifica (nuova area disegnata, import
+# di un file, cancellazione) viene rieseguita la validazione topologica.
+def commit_drawings(store, label):
+    if st.session_state.history.commit(store, label):
+        st.session_state.drawings = store.to_list()
+        st.session_state.validation = validate_drawings(st.session_state.drawings)
+
+# Funzione che annulla o ripete l'ultima operazione sulle aree, riportando
+# la lista di aree alla versione salvata nella cronologia
+def restore_drawings(st_component, redo=False):
+    history = st.session_state.history
+    changed = history.redo() if redo else history.undo()
+    if changed:
+        st.session_state.drawings = history.current.to_list()
+        st.session_state.validation = validate_drawings(st.session_state.drawings)
+        st.session_state.feature_clicked_list = []
+        save_map_state_and_rerun(st_component)
+
+# Funzione che salva nella cronologia l'aggiunta di una nuova area. A differenza
+# di commit_drawings la lista di aree non viene ricostruita e la validazione
+# topologica viene eseguita solo per la nuova area.
+def commit_added_drawing(drawing, label):
+    if st.session_state.history.commit(st.session_state.history.current.append(drawing), label):
+        st.session_state.drawings.append(drawing)
+        validate_appended(st.session_state.drawings, st.session_state.validation, len(st.session_state.drawings) - 1)
+
+# Funzione che salva nella cronologia una versione ottenuta applicando delle
+# differenze (es. import di un file) alla versione corrente. La lista di aree
+# viene ricostruita dalla nuova versione, mentre la validazione topologica
+# viene eseguita solo per le aree con gli id indicati (aggiunte o modificate):
+# per le altre i risultati precedenti vengono solo rinumerati.
+def commit_changed_drawings(store, label, changed_ids):
+    previous = st.session_state.history.current
+    if st.session_state.history.commit(store, label):
+        positions_by_id = {}
+        drawings = []
+        for feature_id, drawing in store.items():
+            positions_by_id[feature_id] = len(drawings)
+            drawings.append(drawing)
+        positions = [positions_by_id.get(feature_id) for feature_id, _ in previous.items()]
+        dirty = [positions_by_id[feature_id] for feature_id in changed_ids if feature_id in positions_by_id]
+        st.session_state.drawings = drawings
+        validate_changes(drawings, st.session_state.validation, positions, dirty)
+
 # Funzione per aggiornare lo stato della sessione
 def update_session_state(last_drawing, st_component):
     if 'drawings' not in st.session_state:
         st.session_state.drawings = []
-    st.session_state.drawings.append(last_drawing)
+    commit_added_drawing(last_drawing, "Aggiunta area")
     
     if st.session_state.bounds_toggle:
-        st.session_state.bounds = calculate_bounds(st.session_state.drawings)
+        st.session_state.bounds = calculate_bounds(st.session_state.validation['boxes'])
     else:
         if 'bounds' in st.session_state:
             del st.session_state['bounds']
@@ -187,50 +258,90 @@ def update_session_state(last_drawing, st_component):
     st.session_state.lon = st_component['center']['lng']
     st.session_state.zoom = st_component['zoom']
         
+# Funzione che restituisce l'indice (chiave -> id, hash del contenuto) delle aree
+# della versione indicata. L'indice viene tenuto nel session state assieme alla
+# versione a cui si riferisce e ricostruito solo se la versione è cambiata.
+def get_feature_index(store):
+    cached = st.session_state.get('feature_index')
+    if cached is not None and cached[0] is store:
+        return cached[1]
+    return build_feature_index(store.items())
+
+# Funzione chiamata quando il file importato non è valido o non contiene
+# aree: il riepilogo dell'ultimo import viene tolto e, se il file doveva
+# sostituire le aree attuali, la mappa viene svuotata. In modalità unione le
+# aree esistenti vengono mantenute.
+def reject_imported_geojson(merge):
+    st.session_state.pop('last_import_diff', None)
+    if not merge:
+        commit_drawings(FeatureStore(), "Import file")
+
 # Funzione che legge e analizza il contenuto del file GeoJSON 
-# importato all'interno del file uploader
-def read_imported_geojson(uploaded_file):
+# importato all'interno del file uploader.
+# Per capire se il file è cambiato viene confrontato solo il suo hash, così
+# nei rerun successivi il file non viene più letto. Le aree del file vengono
+# confrontate con quelle attuali tramite l'hash del loro contenuto e vengono
+# applicate solo le differenze (aree aggiunte, modificate e rimosse).
+# Se merge è True le aree non presenti nel file vengono mantenute.
+def read_imported_geojson(uploaded_file, merge=False):
+    file_bytes = uploaded_file.getvalue()
+    current_file_digest = file_digest(file_bytes)
+    if st.session_state.get('last_uploaded_file') == current_file_digest:
+        return
     try:
-        # Legge il contenuto del file GeoJSON
-        geojson_data = json.load(uploaded_file)
+        # Legge il contenuto del file GeoJSON. Il file letto viene salvato nella
+        # cache condivisa in base al suo hash, così lo stesso file caricato da
+        # altre sessioni non viene riletto
+        geojson_data = get_artifact_cache().get_or_compute("geojson", current_file_digest, lambda: json.loads(file_bytes))
         # st.write(geojson_data)
         
         # Verifica se il file GeoJSON contiene delle features
         if 'features' not in geojson_data or not geojson_data['features']:
             st.error("Il file GeoJSON caricato non contiene aree selezionate (features). Per favore carica un file valido.")
-            st.session_state.drawings = []
+            reject_imported_geojson(merge)
         else:
-            # Converte il geojson, passato come input, in una stringa
-            current_file_content = json.dumps(geojson_data)
-            # st.write(current_file_content)
-
-            # Converte la lista drawings in formato GeoJSON e lo converte in una stringa
-            # per confrontarlo con il file di input
-            features = [Feature(geometry=drawing['geometry'], properties=drawing['properties']) for drawing in st.session_state.drawings]
-            feature_collection = FeatureCollection(features)
-            geojson_str = json.dumps(feature_collection)
-
-            # Se c'è un nuovo file caricato diverso da quello precedente allora la lista di aree dovrà essere
-            # cancellata e aggiornata con le aree presenti nel nuovo file caricato.
-            if 'last_uploaded_file' not in st.session_state or st.session_state.last_uploaded_file != current_file_content:
-                # Salva il contenuto del nuovo file caricato
-                st.session_state.last_uploaded_file = current_file_content
-
-                # Pulisce le aree precedenti
-                st.session_state.drawings = []
-                # Salva le nuove aree caricate nella lista delle aree disegnate
-                for feature in geojson_data['features']:
-                    st.session_state.drawings.append({
-                        'type': 'Feature',
-                        'geometry': feature['geometry'],
-                        'properties': feature['properties']
-                    })
-                # Calcola i bounds e aggiorna il session state
-                st.session_state.bounds = calculate_bounds(st.session_state.drawings)
+            # Salva l'hash del nuovo file caricato
+            st.session_state.last_uploaded_file = current_file_digest
+
+            imported_drawings = []
+            for feature in geojson_data['features']:
+                drawing = {
+                    'type': 'Feature',
+                    'geometry': feature['geometry'],
+                    'properties': feature['properties']
+                }
+                if feature.get('id') is not None:
+                    drawing['id'] = feature['id']
+                imported_drawings.append(drawing)
+
+            # Calcola le differenze con le aree attuali e le applica salvando
+            # l'operazione nella cronologia
+            store = st.session_state.history.current
+            index = get_feature_index(store)
+            diff = diff_features(index, imported_drawings)
+            # Il GeoJSON letto è condiviso con le altre sessioni tramite la cache:
+            # le aree salvate nella sessione (solo quelle aggiunte o modificate)
+            # vengono copiate, così una modifica sul posto non cambia il file
+            # in cache delle altre sessioni
+            for change in ('added', 'changed'):
+                diff[change] = [(key, copy.deepcopy(drawing), content_hash) for key, drawing, content_hash in diff[change]]
+            store = apply_diff(store, index, diff, remove=not merge)
+            st.session_state.feature_index = (store, index)
+            changed_ids = [index[key][0] for key, _, _ in diff['changed'] + diff['added']]
+            commit_changed_drawings(store, "Unione file" if merge else "Import file", changed_ids)
+            st.session_state.last_import_diff = {
+                'added': len(diff['added']),
+                'changed': len(diff['changed']),
+                'removed': 0 if merge else len(diff['removed']),
+                'unchanged': diff['unchanged'],
+            }
+            # Calcola i bounds e aggiorna il session state
+            if st.session_state.drawings:
+                st.session_state.bounds = calculate_bounds(st.session_state.validation['boxes'])
                 
     except json.JSONDecodeError:
         st.error("Errore nella lettura del file GeoJSON. Assicurati che il file sia in un formato valido.")
-        st.session_state.drawings = []
+        reject_imported_geojson(merge)
 
 # Funzione avente 2 parametri, le coordinate del punto cliccato all'interno
 # di un'area presente sulla mappa, e la lista completa di disegni.
@@ -266,18 +377,33 @@ def is_inside_polygon(lat, lng, coordinates):
 
     return is_inside
 
+# Funzione che mostra sotto la mappa i problemi trovati dalla validazione
+# topologica: aree con bordi che si autointersecano e coppie di aree che si
+# sovrappongono, indicando se le due aree hanno tipologie diverse
+def show_validation_issues(drawings, validation):
+    for index in validation['self_intersections']:
+        name = (drawings[index].get('properties') or {}).get('name', '')
+        st.warning(f"L'area n. {index + 1} ({name}) ha un bordo che si autointerseca.")
+    for a, b in validation['overlaps']:
+        name_a = (drawings[a].get('properties') or {}).get('name', '')
+        name_b = (drawings[b].get('properties') or {}).get('name', '')
+        if name_a != name_b:
+            st.error(f"L'area n. {a + 1} ({name_a}) si sovrappone all'area n. {b + 1} ({name_b}) di tipologia diversa.")
+        else:
+            st.warning(f"L'area n. {a + 1} ({name_a}) si sovrappone all'area n. {b + 1} ({name_b}).")
+
 # Funzione che rimuove dalla lista totale di disegni importati o inseriti
 # tutti quelli che l'utente seleziona. Visibili a schermo perchè cambiano colore
-def remove_areas(drawings):
-    # Viene creata una nuova lista che conterrà solo i disegni non selezionati
-    updated_drawings = [feature for feature in drawings if feature not in st.session_state.feature_clicked_list]
-    return updated_drawings
+def remove_areas(store):
+    # Viene creata una nuova versione che conterrà solo i disegni non selezionati
+    updated_store = store.remove_where(lambda feature: feature in st.session_state.feature_clicked_list)
+    return updated_store
 
 # Funzione che rimuove dalla lista tutti i disegni con la tipologia 
 # specificata, sia che l'insieme di tipologie sia singolo che multiplo.
-def remove_areas_by_name(drawings, selected_names):
-    filtered_drawings = [feature for feature in drawings if feature['properties']['name'] not in selected_names]
-    return filtered_drawings
+def remove_areas_by_name(store, selected_names):
+    filtered_store = store.remove_where(lambda feature: feature['properties']['name'] in selected_names)
+    return filtered_store
 
 # Funzione che serve per salvare lo stato attuale della mappa e fare un rerun per
 # aggiornare il contenuto. Questo metodo viene utilizzato quando vengono cancellate aree
@@ -322,11 +448,20 @@ with st.container(border=True):
                                                         key="file_uploader", 
                                                         help="""Il file GeoJSON deve contenere features e deve avere una struttura adeguata. 
                                                         Cliccare sul pulsante X per togliere il file inserito non cambia la mappa.""")
+                merge_import = st.toggle("Unisci alle aree esistenti", value=False,
+                                         help="""Se l'opzione è attiva le aree del file vengono aggiunte (o aggiornate se già presenti)
+                                         mantenendo le aree già inserite. Se è disattivata la mappa conterrà solo le aree del file.
+                                         In entrambi i casi vengono applicate solo le aree aggiunte, modificate o rimosse.""")
 
                 if uploaded_file is not None:
-                    read_imported_geojson(uploaded_file)
+                    read_imported_geojson(uploaded_file, merge=merge_import)
+                    if 'last_import_diff' in st.session_state:
+                        import_diff = st.session_state.last_import_diff
+                        st.caption(f"Ultimo import: {import_diff['added']} aree aggiunte, {import_diff['changed']} modificate, "
+                                   f"{import_diff['removed']} rimosse, {import_diff['unchanged']} invariate")
                 else:
                     st.session_state.last_uploaded_file = None
+                    st.session_state.pop('last_import_diff', None)
         # Mappa chiamata m ottenuta per creare una mappa con
         # diverse impostazioni come zoom, basemap, layer di disegno 
         m = create_map()
@@ -382,6 +517,9 @@ with st.container(border=True):
             
             save_map_state_and_rerun(st_component)
 
+        # Mostra eventuali aree non valide evidenziate in arancione sulla mappa
+        show_validation_issues(st.session_state.drawings, st.session_state.validation)
+
         # st.json(st.session_state.last_uploaded_file)
         # st.write(st.session_state.drawings)
 
@@ -397,6 +535,24 @@ with st.container(border=True):
                 st.session_state.bounds_toggle = new_toggle_value
                 st.rerun()
 
+            # Pulsanti per annullare o ripetere l'ultima operazione sulle aree
+            # (aggiunta, cancellazione o import)
+            history = st.session_state.history
+            undo_col, redo_col = st.columns(2)
+            undo_button = undo_col.button("Annulla", disabled=not history.can_undo, use_container_width=True,
+                                          help=f"Annulla: {history.undo_label}" if history.can_undo else None)
+            redo_button = redo_col.button("Ripeti", disabled=not history.can_redo, use_container_width=True,
+                                          help=f"Ripeti: {history.redo_label}" if history.can_redo else None)
+            if undo_button:
+                restore_drawings(st_component)
+            if redo_button:
+                restore_drawings(st_component, redo=True)
+            history_depth = st.number_input("Numero massimo di operazioni annullabili", min_value=1, max_value=500,
+                                            value=st.session_state.history_depth)
+            if history_depth != st.session_state.history_depth:
+                st.session_state.history_depth = history_depth
+                history.set_max_depth(history_depth)
+
             st.markdown("<p style='margin-bottom: -20px'>Seleziona il tipo di cancellazione</p>", unsafe_allow_html=True)
             tab1, tab2, tab3 = st.tabs(["Canc. per selezione", "Canc. per tipologia", "Tutte le aree"])
 
@@ -406,8 +562,8 @@ with st.container(border=True):
                 remove_single_area_button = st.button("Cancella una o più aree", disabled=not bool(st.session_state.get('feature_clicked_list')), use_container_width=True)
                 # st.write(st.session_state.drawings)
                 if remove_single_area_button:
-                    drawings = remove_areas(st.session_state.drawings)
-                    st.session_state.drawings = drawings
+                    store = remove_areas(st.session_state.history.current)
+                    commit_drawings(store, "Cancellazione per selezione")
                     st.session_state.feature_clicked_list = []
                     save_map_state_and_rerun(st_component)
 
@@ -420,15 +576,15 @@ with st.container(border=True):
                 # st.write(name_area_correct)
                 remove_area_by_name_button = st.button("Cancella aree", disabled=not bool(st.session_state.get('drawings')), use_container_width=True)
                 if remove_area_by_name_button:
-                    drawings = remove_areas_by_name(st.session_state.drawings, name_area_correct)
-                    st.session_state.drawings = drawings
+                    store = remove_areas_by_name(st.session_state.history.current, name_area_correct)
+                    commit_drawings(store, "Cancellazione per tipologia")
                     save_map_state_and_rerun(st_component)
 
             # Caso in cui si sceglie eliminazione totale di tutte le aree inserite
             with tab3:
                 remove_all_button = st.button("Cancella tutte le aree inserite", disabled=not bool(st.session_state.get('drawings')), use_container_width=True)
                 if remove_all_button:
-                    st.session_state.drawings = []
+                    commit_drawings(FeatureStore(), "Cancellazione di tutte le aree")
                     st.session_state.feature_clicked_list = []
                     save_map_state_and_rerun(st_component)
 
@@ -439,7 +595,7 @@ with st.container(border=True):
             # il file contenente tutte le informazioni.
             if 'drawings' in st.session_state:
                 # Converti i disegni in formato GeoJSON
-                features = [Feature(geometry=drawing['geometry'], properties=drawing['properties']) for drawing in st.session_state.drawings]
+                features = [Feature(geometry=drawing['geometry'], properties=drawing['properties'], id=drawing.get('id')) for drawing in st.session_state.drawings]
                 feature_collection = FeatureCollection(features)
                 geojson_str = json.dumps(feature_collection)
 
@@ -5,93 +5,209 @@ import geopandas as gpd
 import numpy as np
 from PIL import Image, ImageOps
 from io import BytesIO, StringIO
-from streamlit_image_comparison import image_comparison
 from utils import setup_sidebar
+from image_delivery import comparison_slider
+from geojson_diff import file_digest
+from jobs import job_key, run_job
+from artifact_cache import get_artifact_cache
+from zonal_stats import (WEB_MERCATOR, reproject_geometries, mapbox_transform, mercator_ground_resolution,
+                         raster_pixel_area, read_geotiff, rasterize_labels, zonal_statistics, class_statistics, statistics_means)
+from geometry_engine import WGS84, crs_key, reproject, flatten_features, feature_metrics, class_metrics
 
 # ========================================================================
 # Definizione di Funzioni
 
-# Funzione per calcolare il centro delle coordinate
-def calculate_center(coordinates):
-    # Estrai tutte le singole coordinate dai poligoni
-    flat_coords = [coord for sublist in coordinates for coord in sublist]
-    
+# Funzione per calcolare il centro delle coordinate (array di longitudini
+# e latitudini in WGS84)
+def calculate_center(lon, lat):
     # Calcola il centro
-    center_lat = np.mean([coord[1] for coord in flat_coords])
-    center_lon = np.mean([coord[0] for coord in flat_coords])
+    center_lat = np.mean(lat)
+    center_lon = np.mean(lon)
     
     return center_lat, center_lon
 
 # Funzione per calcolare il bounding box dalle coordinate
-def calculate_bounding_box(coordinates_list):
-    # Estrai tutte le coordinate e convertile in una lista piatta
-    flat_coords = [coord for sublist in coordinates_list for coord in sublist]
-    
+def calculate_bounding_box(lon, lat):
     # Calcola le coordinate minime e massime
-    min_lon = min(coord[0] for coord in flat_coords)
-    max_lon = max(coord[0] for coord in flat_coords)
-    min_lat = min(coord[1] for coord in flat_coords)
-    max_lat = max(coord[1] for coord in flat_coords)
-    
-    return min_lon, min_lat, max_lon, max_lat
+    return np.min(lon), np.min(lat), np.max(lon), np.max(lat)
 
 # Funzione per calcoare la risoluzione spaziale dell'immagine (metri per pixel)
+# Il bounding box è in WGS84: la risoluzione viene ricavata dalla trasformazione
+# usata da MapBox per l'immagine statica (una sola scala Web Mercator per i due
+# assi), riportata al suolo alla latitudine del centro del bounding box. È la
+# stessa usata per le aree delle statistiche per area.
 def calculate_resolution(bbox, image_dim, pixel_density=1):
-    min_lon, min_lat, max_lon, max_lat = bbox
     width, height = image_dim
 
-    # Calcolo del centro del bounding box
-    center_lat = (min_lat + max_lat) / 2
-
-    # Calcolo della dimensione in metri del bounding box
-    # 111320 è la distanza approssimativa in metri di un grado di latitudine
-    lat_distance = (max_lat - min_lat) * 111320
-    lon_distance = (max_lon - min_lon) * 111320 * np.cos(np.radians(center_lat))
-
     # Dimensione dell'immagine considerando la densità dei pixel
     width *= pixel_density
     height *= pixel_density
 
-    # Calcolo della risoluzione spaziale (metri per pixel)
-    resolution_lat = lat_distance / height
-    resolution_lon = lon_distance / width
-
-    # Calcolo dell'area di un pixel (metri quadrati per pixel)
-    area_pixel = resolution_lat * resolution_lon
-
-    return resolution_lat, resolution_lon, area_pixel
-
-# Funzione per ottenere una immagine statica grazie all'API di MapBox
-@st.cache_data(show_spinner="Fetching data from API...")
+    # Calcolo della risoluzione spaziale (metri per pixel) e
+    # dell'area di un pixel (metri quadrati per pixel)
+    transform = mapbox_transform(bbox, width, height)
+    return mercator_ground_resolution(transform, (bbox[1] + bbox[3]) / 2)
+
+# Funzione per ottenere le coordinate delle aree in array piatti. Il risultato
+# viene salvato nella cache condivisa in base all'hash del file GeoJSON, così
+# sessioni diverse che caricano lo stesso file non lo ricalcolano.
+def get_geometry_buffers(geojson_digest, features):
+    return get_artifact_cache().get_or_compute("geometry_buffers", geojson_digest, lambda: flatten_features(features))
+
+# Funzione per calcolare il centro e il bounding box in WGS84 delle aree,
+# salvati nella cache condivisa in base all'hash del file e al CRS
+def get_bounds(geojson_digest, features, source_crs):
+    def compute():
+        flat = get_geometry_buffers(geojson_digest, features)
+        outline = flat['outline_mask']  # Considera solo il contorno esterno
+        lon, lat = reproject(flat['x'][outline], flat['y'][outline], source_crs, WGS84)
+        if len(lon) == 0:
+            return None
+        center_lat, center_lon = calculate_center(lon, lat)
+        bbox = [float(value) for value in calculate_bounding_box(lon, lat)]
+        return float(center_lat), float(center_lon), bbox
+    return get_artifact_cache().get_or_compute("bounds", geojson_digest, compute, crs=source_crs)
+
+# Funzione per calcolare area e perimetro in metri di ogni area e di ogni
+# classe (nome dell'area), riproiettando le coordinate dal CRS del file
+def calculate_area_metrics(geojson_digest, features, source_crs):
+    def compute():
+        flat = get_geometry_buffers(geojson_digest, features)
+        areas, perimeters = feature_metrics(flat, source_crs, len(features))
+        names = [str((feature.get('properties') or {}).get('name', '')) for feature in features]
+        classes, counts, class_areas, class_perimeters = class_metrics(names, areas, perimeters)
+        feature_table = {
+            "Nome": names,
+            "Area (m²)": np.round(areas, 2),
+            "Perimetro (m)": np.round(perimeters, 2),
+        }
+        class_table = {
+            "Classe": classes,
+            "Numero aree": counts,
+            "Area totale (m²)": np.round(class_areas, 2),
+            "Perimetro totale (m)": np.round(class_perimeters, 2),
+        }
+        return feature_table, class_table
+    return get_artifact_cache().get_or_compute("area_metrics", geojson_digest, compute, crs=source_crs)
+
+# Funzione eseguita in background che scarica l'immagine statica dall'API di
+# MapBox a blocchi, aggiornando l'avanzamento e controllando ad ogni blocco
+# se il download è stato annullato
+def fetch_static_map_image(job, bbox, mapbox_api_key):
+    url = f"https://api.mapbox.com/styles/v1/mapbox/satellite-v9/static/{bbox}/600x600@2x?access_token={mapbox_api_key}"
+    with requests.get(url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        total_size = int(response.headers.get('Content-Length', 0))
+        content = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            content.extend(chunk)
+            if total_size:
+                job.set_progress(len(content) / total_size, "Fetching data from API...")
+            else:
+                job.check_cancelled()
+    return bytes(content)
+
+# Funzione per ottenere una immagine statica grazie all'API di MapBox.
+# Il download viene eseguito in background dall'executor condiviso, quindi più
+# sessioni che richiedono lo stesso bounding box usano lo stesso download.
+# Finché il download non è terminato la pagina ne mostra l'avanzamento senza
+# bloccarsi; al termine viene restituita l'immagine (o None in caso di errore).
 def get_static_map_image(bbox):
     mapbox_api_key = st.secrets["api_keys"]["static_image_mapbox"]
-    url = f"https://api.mapbox.com/styles/v1/mapbox/satellite-v9/static/{bbox}/600x600@2x?access_token={mapbox_api_key}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.content
-    else:
-        st.error("Errore durante il recupero dell'immagine statica della mappa.")
-
-# Funzione per convertire una immagine in bianco e nero
-@st.cache_data()
+    return run_job(job_key("static_map_image", bbox), "Fetching data from API...",
+                   fetch_static_map_image, bbox, mapbox_api_key,
+                   cancelled_message="Il download dell'immagine statica della mappa è stato annullato.",
+                   error_message="Errore durante il recupero dell'immagine statica della mappa.")
+
+# Funzione per convertire una immagine in bianco e nero.
+# Il layer viene salvato nella cache condivisa in base all'hash dell'immagine.
 def convert_to_bw(image_bytes):
-    # Apri l'immagine utilizzando PIL
-    img = Image.open(BytesIO(image_bytes))
-    # Converti l'immagine in scala di grigi
-    img_bw = img.convert('L')
-    # Ritorna l'immagine convertita in scala di grigi
-    return img_bw
-
-# Funzione per convertire una immagine in una scala di colori pseudotermica
-@st.cache_data()
+    def compute():
+        # Apri l'immagine utilizzando PIL
+        img = Image.open(BytesIO(image_bytes))
+        # Converti l'immagine in scala di grigi
+        img_bw = img.convert('L')
+        # Ritorna l'immagine convertita in scala di grigi
+        return img_bw
+    return get_artifact_cache().get_or_compute("layer", file_digest(image_bytes), compute, layer="bw")
+
+# Funzione per convertire una immagine in una scala di colori pseudotermica.
+# Il layer viene salvato nella cache condivisa in base all'hash dell'immagine e ai colori.
 def convert_to_thermal(image_bytes, first_color, second_color):
-    # Apri l'immagine utilizzando PIL
-    img = Image.open(BytesIO(image_bytes))
-    # Converti l'immagine in scala di grigi
-    img_gray = img.convert('L')
-    # Applica un effetto di mappa termica
-    img_thermal = ImageOps.colorize(img_gray, black=first_color, white=second_color, midpoint=128)
-    return img_thermal
+    def compute():
+        # Apri l'immagine utilizzando PIL
+        img = Image.open(BytesIO(image_bytes))
+        # Converti l'immagine in scala di grigi
+        img_gray = img.convert('L')
+        # Applica un effetto di mappa termica
+        img_thermal = ImageOps.colorize(img_gray, black=first_color, white=second_color, midpoint=128)
+        return img_thermal
+    return get_artifact_cache().get_or_compute("layer", file_digest(image_bytes), compute,
+                                               layer="thermal", first_color=first_color, second_color=second_color)
+
+# Funzione per leggere un GeoTIFF caricato. Il risultato viene salvato nella
+# cache condivisa usando l'hash del file.
+def load_geotiff(cache, geotiff_digest, file_bytes):
+    def compute():
+        rgb, transform, raster_crs = read_geotiff(file_bytes)
+        height, width = rgb.shape[:2]
+        return rgb, transform, raster_crs, raster_pixel_area(transform, raster_crs, width, height)
+    return cache.get_or_compute("geotiff", geotiff_digest, compute)
+
+# Funzione per calcolare le statistiche dei pixel (numero di pixel, area, media RGB,
+# luminosità, indice ExG e istogramma della luminosità) per ogni area e per ogni classe.
+# Tutte le aree vengono rasterizzate una sola volta in un'immagine di etichette e
+# le statistiche sono calcolate con riduzioni raggruppate. L'immagine di etichette
+# (maschera) dipende solo dalle aree e dalla griglia del raster, mentre le statistiche
+# dipendono anche dall'immagine: entrambe vengono salvate nella cache condivisa.
+# La funzione viene eseguita in background (vedi zonal_statistics_job).
+def calculate_zonal_statistics(job, cache, geojson_digest, image_digest, features, rgb, transform, raster_crs,
+                               source_crs, pixel_area):
+    grid = {'shape': list(rgb.shape[:2]), 'transform': list(transform)[:6], 'raster_crs': raster_crs, 'crs': source_crs}
+
+    def compute_labels():
+        geometries = reproject_geometries(features, source_crs, raster_crs)
+        return rasterize_labels(geometries, rgb.shape[:2], transform)
+
+    def zonal_tables(labels):
+        names = [str((feature.get('properties') or {}).get('name', '')) for feature in features]
+        stats = zonal_statistics(labels, rgb, len(features), pixel_area)
+        grouped = class_statistics(stats, names)
+
+        tables = []
+        for group_names, group_stats in ((names, stats), (grouped['classes'], grouped)):
+            means = statistics_means(group_stats)
+            tables.append({
+                "Nome": group_names,
+                "Pixel": group_stats['count'].astype(int),
+                "Area pixel (m²)": np.round(group_stats['area'], 2),
+                "Media R": np.round(means['rgb'][:, 0], 2),
+                "Media G": np.round(means['rgb'][:, 1], 2),
+                "Media B": np.round(means['rgb'][:, 2], 2),
+                "Luminosità": np.round(means['luminance'], 2),
+                "ExG": np.round(means['exg'], 4),
+            })
+        class_histograms = {str(name): histogram for name, histogram in zip(grouped['classes'], grouped['histogram'])}
+        return tables[0], tables[1], class_histograms
+
+    def compute():
+        job.set_progress(0.3, "Rasterizzazione delle aree...")
+        labels = cache.get_or_compute("mask", geojson_digest, compute_labels, **grid)
+        job.set_progress(0.6, "Calcolo delle statistiche per area...")
+        return zonal_tables(labels)
+
+    return cache.get_or_compute("zonal_stats", geojson_digest, compute,
+                                image=image_digest, pixel_area=pixel_area, **grid)
+
+# Funzione eseguita in background dall'executor condiviso: legge l'immagine
+# (read_raster restituisce immagine RGB, trasformazione, CRS e area di un
+# pixel) e calcola le statistiche per area, così la pagina non si blocca
+# durante la lettura del GeoTIFF, la rasterizzazione e le riduzioni.
+def zonal_statistics_job(job, cache, geojson_digest, image_digest, features, source_crs, read_raster):
+    job.set_progress(0.0, "Lettura dell'immagine...")
+    rgb, transform, raster_crs, pixel_area = read_raster()
+    return calculate_zonal_statistics(job, cache, geojson_digest, image_digest, features, rgb, transform,
+                                      raster_crs, source_crs, pixel_area)
 
 def rgb_to_hex(rgb):
     return '#%02x%02x%02x' % tuple(rgb)
@@ -142,12 +258,24 @@ with uploader_col:
                 "File uploader per GeoJson",
                 type=["geojson"], 
             )
+    # File uploader opzionale per un GeoTIFF su cui calcolare le statistiche per area
+    geotiff_data = st.file_uploader(
+                "File uploader per GeoTIFF (opzionale)",
+                type=["tif", "tiff"],
+                help="Se viene caricato un GeoTIFF le statistiche per area vengono calcolate sui suoi pixel invece che sull'immagine satellitare di MapBox.",
+            )
     
 with select_col:
     # Selectbox per selezionare i diversi layer/algoritmi da applicare all'immagine
     selected_layer = st.selectbox("Seleziona layer da applicare all'immagine", 
                                         options=["Black and White (BW)", "Pseudo Thermal (PT)"])
     black_col, white_col = st.columns(2)
+    # Formato e qualità con cui le immagini vengono inviate al browser
+    format_col, quality_col = st.columns(2)
+    image_format = format_col.radio("Formato immagini", options=["WEBP", "JPEG"], horizontal=True,
+                                    help="Formato usato per inviare le immagini allo slider. WebP produce file più leggeri a parità di qualità.")
+    image_quality = quality_col.slider("Qualità immagini", min_value=10, max_value=100, value=85,
+                                       help="Qualità di compressione delle immagini mostrate nello slider. Valori più bassi riducono i dati inviati.")
 
 
 if data is not None:
@@ -158,10 +286,16 @@ if data is not None:
         uploaded_geojson = data
 
         file_contents = uploaded_geojson.read().decode('utf-8')
+        geojson_digest = file_digest(file_contents.encode('utf-8'))
         
-        geojson_data = json.load(StringIO(file_contents))
-        gdp_data = gpd.read_file(StringIO(file_contents))
-        crs_data = gdp_data.crs
+        # Il file letto e il suo CRS vengono salvati nella cache condivisa in base
+        # all'hash del file, così non vengono riletti da altre sessioni
+        cache = get_artifact_cache()
+        geojson_data = cache.get_or_compute("geojson", geojson_digest, lambda: json.load(StringIO(file_contents)))
+        crs_data = cache.get_or_compute("crs", geojson_digest,
+                                        lambda: crs_key(gpd.read_file(StringIO(file_contents)).crs))
+        # Se il file non indica un CRS si assume WGS84, come previsto da GeoJSON
+        source_crs = crs_data
 
         # Verifica se il file contiene almeno una feature, cioè un'area selezionata,
         # verificando se è presente l'attributo features oppure se la lunghezza
@@ -179,20 +313,15 @@ if data is not None:
             
             if valid_geometry:
                 # Se la geometria è valida, cioè di tipo Polygon allora estrae 
-                # le coordinate salvandole in una lista
-                coordinates = []
-                for feature in geojson_data['features']:
-                    coords = feature['geometry']['coordinates'][0][:-1]  # Considera solo il contorno esterno
-                    coordinates.append(coords)
+                # le coordinate in array piatti, le riproietta in WGS84
+                # (longitudine, latitudine) con una sola chiamata e calcola
+                # il centro e il bounding box dell'area selezionata
+                bounds = get_bounds(geojson_digest, geojson_data['features'], source_crs)
                 
                 # Visualizza le coordinate solo se necessario
-                if coordinates:
-                    # Calcola il centro dell'area selezionata
-                    center_lat, center_lon = calculate_center(coordinates)
-
-                    # Calcola il bounding box
-                    min_lon, min_lat, max_lon, max_lat = calculate_bounding_box(coordinates)
-                    bbox = [min_lon, min_lat, max_lon, max_lat]
+                if bounds is not None:
+                    center_lat, center_lon, bbox = bounds
+                    min_lon, min_lat, max_lon, max_lat = bbox
 
                     # Calcola la risoluzione spaziale
                     image_dim = (600, 600)  # Dimensioni base dell'immagine (larghezza, altezza)
@@ -207,6 +336,8 @@ if data is not None:
                         # Ottieni l'immagine statica tramite chiamata API e la salva
                         # grazie al sessione state
                         static_map_bytes = get_static_map_image(bbox)
+                        if static_map_bytes is None:
+                            st.stop()
                         # Converte l'immagine statica in un oggetto PIL
                         static_map_image = Image.open(BytesIO(static_map_bytes))
                         # Memorizza l'immagine statica e il bounding box
@@ -252,6 +383,13 @@ if data is not None:
                                 </div>
                             """, unsafe_allow_html=True)
 
+                        # Sezione con area e perimetro in metri per classe e per singola area
+                        st.subheader("Aree e Perimetri")
+                        feature_table, class_table = calculate_area_metrics(geojson_digest, geojson_data['features'], source_crs)
+                        st.dataframe(class_table, use_container_width=True, hide_index=True)
+                        with st.expander("Apri per vedere area e perimetro di ogni singola area"):
+                            st.dataframe(feature_table, use_container_width=True, hide_index=True)
+
 
 
                             
@@ -261,16 +399,17 @@ if data is not None:
                         if selected_layer == "Black and White (BW)":
                             # Converti l'immagine statica in bianco e nero
                             img_bw = convert_to_bw(static_map_bytes)
-                            image_comparison(
+                            comparison_slider(
                                 img1=static_map_image,
-                                img2= img_bw,
+                                img2=img_bw,
                                 label1="Mappa",
                                 label2="BW",
                                 width=580,
                                 starting_position=85,
                                 show_labels=True,
                                 make_responsive=True,
-                                in_memory=True,
+                                image_format=image_format,
+                                quality=image_quality,
                             )
                         elif selected_layer == "Pseudo Thermal (PT)":
                             first_color = black_col.color_picker("Seleziona il colore per i toni **scuri** dell'immagine", value="#000000",
@@ -279,17 +418,54 @@ if data is not None:
                                                                     help="Questo colore viene utilizzato per le aree più luminose della mappa. Colori chiari come il giallo o il lavanda possono illuminare l'immagine e mettere in risalto le caratteristiche chiave.")
                             # Converti l'immagine statica in pseudo thermal
                             img_pt = convert_to_thermal(static_map_bytes, first_color, second_color)
-                            image_comparison(
+                            comparison_slider(
                                 img1=static_map_image,
-                                img2= img_pt,
+                                img2=img_pt,
                                 label1="Mappa",
                                 label2="PT",
                                 width=580,
                                 starting_position=85,
                                 show_labels=True,
                                 make_responsive=True,
-                                in_memory=True,
+                                image_format=image_format,
+                                quality=image_quality,
                             )
+
+                    # Sezione con le statistiche dei pixel per area e per classe, calcolate
+                    # sul GeoTIFF caricato oppure sull'immagine satellitare di MapBox
+                    st.subheader("Statistiche per Area")
+                    # Il calcolo viene eseguito in background: finché non è terminato
+                    # viene mostrato l'avanzamento con un pulsante per annullarlo
+                    artifact_cache = get_artifact_cache()
+                    if geotiff_data is not None:
+                        geotiff_bytes = geotiff_data.getvalue()
+                        image_digest = file_digest(geotiff_bytes)
+                        read_raster = lambda: load_geotiff(artifact_cache, image_digest, geotiff_bytes)
+                        error_message = "Errore nella lettura del GeoTIFF: {error} Carica un GeoTIFF georeferenziato valido."
+                    else:
+                        image_digest = file_digest(static_map_bytes)
+                        raster_transform = mapbox_transform(bbox, static_map_image.width, static_map_image.height)
+                        # Area al suolo di un pixel alla latitudine delle aree
+                        _, _, pixel_area = mercator_ground_resolution(raster_transform, center_lat)
+                        read_raster = lambda: (np.asarray(Image.open(BytesIO(static_map_bytes)).convert('RGB')),
+                                               raster_transform, WEB_MERCATOR, pixel_area)
+                        error_message = "Errore durante il calcolo delle statistiche per area: {error}"
+                    zonal_result = run_job(job_key("zonal_statistics", geojson_digest, image_digest, source_crs),
+                                           "Calcolo delle statistiche per area...", zonal_statistics_job,
+                                           artifact_cache, geojson_digest, image_digest, geojson_data['features'],
+                                           source_crs, read_raster,
+                                           cancelled_message="Il calcolo delle statistiche per area è stato annullato.",
+                                           error_message=error_message)
+                    if zonal_result is not None:
+                        feature_stats, class_stats, class_histograms = zonal_result
+                        stats_col, histogram_col = st.columns(2)
+                        with stats_col:
+                            st.dataframe(class_stats, use_container_width=True, hide_index=True)
+                        with histogram_col:
+                            # Istogramma della luminosità dei pixel di ogni classe
+                            st.line_chart(class_histograms)
+                        with st.expander("Apri per vedere le statistiche di ogni singola area"):
+                            st.dataframe(feature_stats, use_container_width=True, hide_index=True)
             else:
                 st.error("Il file GeoJSON deve contenere solo geometrie di tipo Polygon.")
 
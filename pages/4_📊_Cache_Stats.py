@@ -0,0 +1,43 @@
+import streamlit as st
+from utils import setup_sidebar
+from artifact_cache import get_artifact_cache
+
+# ============ DEFINIZIONE SIDEBAR E STRUTTURA PAGINA ===============
+
+st.set_page_config(layout="wide")
+setup_sidebar()
+
+st.markdown("<h1 style='text-align: center; margin-top: -60px;'>Cache Stats</h1>", unsafe_allow_html=True)
+st.write("""In questa sezione è possibile monitorare la cache condivisa tra le sessioni, nella quale vengono salvati
+         i file GeoJSON letti, le coordinate, i bounding box, le maschere e i layer calcolati. Le stesse statistiche sono
+         disponibili in formato JSON all'indirizzo `app/static/cache_stats.json`.
+         """)
+
+# ============ CODICE PRINCIPALE DELLA PAGINA ===============
+
+stats = get_artifact_cache().stats()
+
+# Occupazione dei due livelli della cache (memoria e disco) rispetto al budget
+memory_col, disk_col = st.columns(2)
+for col, name, tier in ((memory_col, "Memoria", stats['memory']), (disk_col, "Disco", stats['disk'])):
+    with col:
+        with st.container(border=True):
+            st.metric(f"{name} ({tier['entries']} elementi)", f"{tier['bytes'] / 1024 ** 2:.1f} MB",
+                      help=f"Budget: {tier['budget'] / 1024 ** 2:.0f} MB")
+            st.progress(min(tier['bytes'] / tier['budget'], 1.0))
+
+# Hit e miss per ogni tipo di risultato salvato nella cache
+st.subheader("Hit rate per tipo")
+if stats['kinds']:
+    st.dataframe({
+        "Tipo": list(stats['kinds']),
+        "Hit memoria": [kind['memory_hits'] for kind in stats['kinds'].values()],
+        "Hit disco": [kind['disk_hits'] for kind in stats['kinds'].values()],
+        "Miss": [kind['misses'] for kind in stats['kinds'].values()],
+        "Hit rate (%)": [round(kind['hit_rate'] * 100, 1) for kind in stats['kinds'].values()],
+    }, use_container_width=True, hide_index=True)
+else:
+    st.info("La cache non è ancora stata utilizzata.")
+
+if st.button("Aggiorna"):
+    st.rerun()
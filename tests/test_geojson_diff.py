@@ -0,0 +1,52 @@
+import random
+
+from geojson_diff import apply_diff, build_feature_index, diff_features
+from history import FeatureStore
+
+def feature(x, name, feature_id=None):
+    drawing = {'type': 'Feature', 'properties': {'name': name},
+               'geometry': {'type': 'Polygon', 'coordinates': [[[x, 0], [x + 1, 0], [x + 1, 1], [x, 0]]]}}
+    if feature_id is not None:
+        drawing['id'] = feature_id
+    return drawing
+
+def random_features(rng, n):
+    # Poche geometrie diverse, così ci sono molte geometrie duplicate
+    return [feature(rng.randint(0, 5), rng.choice("ab"), rng.choice([None, None, rng.randint(0, 5)]))
+            for _ in range(n)]
+
+def import_file(store, index, features, merge):
+    diff = diff_features(index, features)
+    return apply_diff(store, index, diff, remove=not merge), diff
+
+def test_diff_counts():
+    store = FeatureStore.from_features([feature(0, "a"), feature(1, "a", feature_id=7), feature(2, "a")])
+    index = build_feature_index(store.items())
+    diff = diff_features(index, [feature(0, "a"), feature(5, "b", feature_id=7), feature(3, "a")])
+    assert len(diff['added']) == 1 and len(diff['removed']) == 1
+    assert len(diff['changed']) == 1 and diff['unchanged'] == 1
+
+# Dopo ogni import l'indice aggiornato sul posto deve essere uguale a quello
+# ricostruito da zero, e reimportare lo stesso file non deve cambiare nulla
+def test_index_updated_in_place_matches_rebuilt_index():
+    rng = random.Random(1)
+    for merge in (False, True):
+        store = FeatureStore()
+        index = build_feature_index(store.items())
+        for _ in range(100):
+            features = random_features(rng, rng.randint(0, 12))
+            store, _ = import_file(store, index, features, merge)
+            assert index == build_feature_index(store.items())
+            if not merge:
+                assert sorted(map(repr, store)) == sorted(map(repr, features))
+            store, diff = import_file(store, index, features, merge)
+            assert not diff['added'] and not diff['changed']
+            assert merge or not diff['removed']
+
+def test_merge_keeps_areas_missing_from_file():
+    store = FeatureStore.from_features([feature(0, "a"), feature(1, "a")])
+    index = build_feature_index(store.items())
+    store, diff = import_file(store, index, [feature(1, "b"), feature(2, "b")], merge=True)
+    assert len(diff['removed']) == 1 and len(diff['changed']) == 1 and len(diff['added']) == 1
+    assert [drawing['properties']['name'] for drawing in store] == ["a", "b", "b"]
+    assert index == build_feature_index(store.items())
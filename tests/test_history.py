@@ -0,0 +1,75 @@
+import random
+
+from history import DrawingsHistory, FeatureStore
+
+def feature(value):
+    return {'type': 'Feature', 'properties': {'name': str(value)}, 'geometry': None}
+
+# Il trie deve aggiungere livelli oltre 32 e 1024 aree, sia con append sia con from_features
+def test_store_grows_past_one_and_two_levels():
+    features = [feature(i) for i in range(1100)]
+    store = FeatureStore()
+    for index, value in enumerate(features):
+        store = store.append(value)
+        if index + 1 in (32, 33, 1024, 1025):
+            assert store.to_list() == features[:index + 1]
+    assert len(store) == 1100
+    assert store.get(1099) is features[1099]
+    assert FeatureStore.from_features(features).to_list() == features
+    assert FeatureStore.from_features(features[:1025]).append(features[1025]).to_list() == features[:1026]
+
+# remove_ids e replace confrontati con una semplice lista di coppie (id, area)
+def test_remove_and_replace_match_list_model():
+    rng = random.Random(0)
+    store = FeatureStore.from_features([feature(i) for i in range(300)])
+    model = list(enumerate(store))
+    for step in range(200):
+        ids = [feature_id for feature_id, _ in model]
+        if rng.random() < 0.4 and ids:
+            removed = set(rng.sample(ids, min(len(ids), rng.randint(1, 10))))
+            store = store.remove_ids(removed | {10_000})
+            model = [(i, f) for i, f in model if i not in removed]
+        elif rng.random() < 0.5 and ids:
+            replaced = {feature_id: feature(('r', step, feature_id)) for feature_id in rng.sample(ids, min(len(ids), 5))}
+            store = store.replace(replaced)
+            model = [(i, replaced.get(i, f)) for i, f in model]
+        else:
+            added = [feature(('a', step, k)) for k in range(rng.randint(1, 40))]
+            model += list(enumerate(added, start=store.next_id))
+            store = store.extend(added)
+        assert list(store.items()) == model
+        assert len(store) == len(model)
+
+def test_unchanged_operations_return_same_store():
+    store = FeatureStore.from_features([feature(0)])
+    assert store.remove_ids([5]) is store
+    assert store.replace({5: feature(5)}) is store
+
+def test_undo_redo():
+    first = FeatureStore().append(feature(0))
+    second = first.append(feature(1))
+    history = DrawingsHistory()
+    assert history.commit(first, "uno")
+    assert history.commit(second, "due")
+    assert not history.commit(second, "due")
+    assert history.undo_label == "due"
+    assert history.undo() and history.current is first
+    assert history.redo_label == "due"
+    assert history.redo() and history.current is second
+    assert history.undo() and history.undo() and len(history.current) == 0
+    assert not history.undo()
+    # Un nuovo salvataggio cancella le operazioni da ripetere
+    history.commit(second, "tre")
+    assert not history.can_redo
+
+def test_depth_trimming_keeps_latest_operations():
+    history = DrawingsHistory(max_depth=3)
+    store = FeatureStore()
+    for i in range(5):
+        store = store.append(feature(i))
+        history.commit(store, str(i))
+    assert history.undo_label == "4"
+    history.set_max_depth(2)
+    assert history.undo() and history.undo()
+    assert not history.can_undo
+    assert len(history.current) == 3
@@ -0,0 +1,49 @@
+import random
+
+from validation import geometries_overlap, sweep_candidate_pairs, validate_changes, validate_drawings
+
+def polygon_feature(coordinates):
+    return {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [coordinates]}}
+
+def square(x, y, side):
+    return polygon_feature([[x, y], [x + side, y], [x + side, y + side], [x, y + side], [x, y]])
+
+L_SHAPE = [[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2], [0, 0]]
+
+# Due aree concave identiche: tutti i vertici e i punti medi cadono sul bordo
+def test_duplicate_concave_polygons_overlap():
+    drawings = [polygon_feature(L_SHAPE), polygon_feature(L_SHAPE)]
+    assert geometries_overlap(drawings[0]['geometry'], drawings[1]['geometry'])
+    assert validate_drawings(drawings)['overlaps'] == [(0, 1)]
+
+def test_adjacent_polygons_do_not_overlap():
+    assert not geometries_overlap(square(0, 0, 1)['geometry'], square(1, 0, 1)['geometry'])
+
+# Le coppie candidate devono essere tutte e sole quelle con bounding box sovrapposti
+def test_sweep_candidate_pairs_matches_brute_force():
+    boxes = [(x % 7, (x * 3) % 11, x % 7 + x % 3, (x * 3) % 11 + x % 4) for x in range(60)]
+    expected = {(i, j) for i in range(len(boxes)) for j in range(i + 1, len(boxes))
+                if boxes[i][0] <= boxes[j][2] and boxes[j][0] <= boxes[i][2]
+                and boxes[i][1] <= boxes[j][3] and boxes[j][1] <= boxes[i][3]}
+    assert {tuple(sorted(pair)) for pair in sweep_candidate_pairs(boxes)} == expected
+
+# La validazione incrementale deve dare lo stesso risultato di quella completa
+def test_validate_changes_matches_full_validation():
+    rng = random.Random(3)
+    for _ in range(200):
+        old = [square(rng.randint(0, 30), rng.randint(0, 30), rng.randint(1, 6)) for _ in range(rng.randint(0, 30))]
+        validation = validate_drawings(old)
+        new, positions, dirty = [], [], []
+        for drawing in old:
+            if rng.random() < 0.2:
+                positions.append(None)
+                continue
+            positions.append(len(new))
+            if rng.random() < 0.2:
+                dirty.append(len(new))
+                drawing = polygon_feature(L_SHAPE) if rng.random() < 0.5 else square(rng.randint(0, 30), 0, 3)
+            new.append(drawing)
+        for _ in range(rng.randint(0, 5)):
+            dirty.append(len(new))
+            new.append(square(rng.randint(0, 30), rng.randint(0, 30), 4))
+        assert validate_changes(new, validation, positions, dirty) == validate_drawings(new)
@@ -0,0 +1,349 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+import numpy as np
+
+# ============ VALIDAZIONE TOPOLOGICA DELLE AREE ===============
+
+# Funzione che estrae la lista di poligoni (ognuno come lista di anelli) da una
+# geometria GeoJSON, gestendo sia Polygon che MultiPolygon
+def get_polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+# Funzione che converte un anello in una lista di segmenti (x1, y1, x2, y2)
+# eliminando i vertici consecutivi duplicati, che creerebbero segmenti di
+# lunghezza nulla e quindi false intersezioni con i segmenti vicini
+def ring_to_segments(ring):
+    points = []
+    for coord in ring:
+        point = (coord[0], coord[1])
+        if not points or points[-1] != point:
+            points.append(point)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return [(*points[i], *points[(i + 1) % len(points)]) for i in range(len(points))] if len(points) > 2 else []
+
+# Funzione che calcola il bounding box (min_x, min_y, max_x, max_y) di una geometria
+def geometry_bbox(geometry):
+    xs, ys = [], []
+    for polygon in get_polygons(geometry):
+        for ring in polygon:
+            xs.extend(coord[0] for coord in ring)
+            ys.extend(coord[1] for coord in ring)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+# Funzione che restituisce il segno dell'orientamento della terna di punti
+# (1 antiorario, -1 orario, 0 allineati)
+def _orientation(ax, ay, bx, by, cx, cy):
+    value = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (value > 0) - (value < 0)
+
+def _on_segment(ax, ay, bx, by, cx, cy):
+    return min(ax, bx) <= cx <= max(ax, bx) and min(ay, by) <= cy <= max(ay, by)
+
+# Funzione che verifica se due segmenti si intersecano. Con proper=True vengono
+# considerati solo gli attraversamenti veri e propri, escludendo i casi in cui
+# i segmenti si toccano in un estremo o sono sovrapposti lungo un lato comune
+# (come succede tra due aree adiacenti).
+def segments_intersect(s1, s2, proper=False):
+    ax, ay, bx, by = s1[:4]
+    cx, cy, dx, dy = s2[:4]
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+    if o1 * o2 < 0 and o3 * o4 < 0:
+        return True
+    if proper:
+        return False
+    return ((o1 == 0 and _on_segment(ax, ay, bx, by, cx, cy)) or
+            (o2 == 0 and _on_segment(ax, ay, bx, by, dx, dy)) or
+            (o3 == 0 and _on_segment(cx, cy, dx, dy, ax, ay)) or
+            (o4 == 0 and _on_segment(cx, cy, dx, dy, bx, by)))
+
+# Classe che mantiene gli intervalli y degli elementi attivi della sweep line
+# e trova quelli che si sovrappongono a un intervallo [min_y, max_y] visitando
+# solo gli intervalli restituiti. Un intervallo attivo si sovrappone se:
+# - contiene min_y (ricerca con un segment tree sulle coordinate y compresse)
+# - oppure inizia dopo min_y ma non oltre max_y (ricerca binaria su una lista
+#   ordinata per y minima)
+# I due casi sono disgiunti, quindi ogni coppia viene restituita una sola volta.
+class _ActiveIntervals:
+    def __init__(self, coordinates):
+        self._coordinates = coordinates
+        self._size = 1
+        while self._size < len(coordinates):
+            self._size *= 2
+        self._nodes = {}
+        self._starts = []
+
+    def _index(self, value):
+        return bisect_left(self._coordinates, value)
+
+    # Restituisce i nodi del segment tree che coprono l'intervallo di indici [low, high]
+    def _cover(self, low, high):
+        low += self._size
+        high += self._size + 1
+        while low < high:
+            if low & 1:
+                yield low
+                low += 1
+            if high & 1:
+                high -= 1
+                yield high
+            low >>= 1
+            high >>= 1
+
+    def add(self, item, min_y, max_y):
+        for node in self._cover(self._index(min_y), self._index(max_y)):
+            self._nodes.setdefault(node, set()).add(item)
+        insort(self._starts, (min_y, item))
+
+    def remove(self, item, min_y, max_y):
+        for node in self._cover(self._index(min_y), self._index(max_y)):
+            self._nodes[node].discard(item)
+        del self._starts[bisect_left(self._starts, (min_y, item))]
+
+    def overlapping(self, min_y, max_y):
+        node = self._index(min_y) + self._size
+        while node >= 1:
+            yield from self._nodes.get(node, ())
+            node >>= 1
+        start = bisect_right(self._starts, (min_y, float('inf')))
+        end = bisect_right(self._starts, (max_y, float('inf')))
+        for _, item in self._starts[start:end]:
+            yield item
+
+# Funzione generica di sweep line sull'asse x: gli elementi (con il loro bounding
+# box) vengono ordinati per x minima e mantenuti in un heap di elementi "attivi"
+# ordinato per x massima, così quelli che non possono più intersecare nulla
+# vengono tolti in O(log n). Gli intervalli y degli elementi attivi sono
+# indicizzati (_ActiveIntervals), così per ogni nuovo elemento vengono visitati
+# solo gli elementi attivi il cui intervallo y si sovrappone al suo.
+# Il costo è O(n log n + k) dove k è il numero di coppie candidate (più lo
+# spostamento in memoria della lista ordinata, che in pratica è trascurabile).
+def sweep_candidate_pairs(boxes):
+    order = sorted(range(len(boxes)), key=lambda i: boxes[i][0])
+    active = []
+    intervals = _ActiveIntervals(sorted({y for box in boxes for y in (box[1], box[3])}))
+    for i in order:
+        min_x, min_y, max_x, max_y = boxes[i]
+        while active and active[0][0] < min_x:
+            _, j = heapq.heappop(active)
+            intervals.remove(j, boxes[j][1], boxes[j][3])
+        for j in intervals.overlapping(min_y, max_y):
+            yield j, i
+        heapq.heappush(active, (max_x, i))
+        intervals.add(i, min_y, max_y)
+
+def _segment_box(segment):
+    x1, y1, x2, y2 = segment[:4]
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+# Funzione che verifica se un'area ha anelli che si autointersecano o che si
+# attraversano tra loro. I segmenti consecutivi dello stesso anello condividono
+# un vertice e quindi non vengono confrontati.
+def is_self_intersecting(geometry):
+    segments = []
+    for p, polygon in enumerate(get_polygons(geometry)):
+        for r, ring in enumerate(polygon):
+            ring_segments = ring_to_segments(ring)
+            for s, segment in enumerate(ring_segments):
+                segments.append((*segment, (p, r), s, len(ring_segments)))
+
+    for i, j in sweep_candidate_pairs([_segment_box(segment) for segment in segments]):
+        s1, s2 = segments[i], segments[j]
+        same_ring = s1[4] == s2[4]
+        if same_ring:
+            distance = abs(s1[5] - s2[5])
+            if distance == 1 or distance == s1[6] - 1:
+                continue
+        # Anelli diversi possono toccarsi in un punto ma non attraversarsi
+        if segments_intersect(s1, s2, proper=not same_ring):
+            return True
+    return False
+
+# Funzione che verifica la posizione di un punto rispetto a un anello con
+# l'algoritmo di Ray Casting: 1 se interno, 0 se sul bordo, -1 se esterno
+def point_in_ring(x, y, ring):
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if _orientation(xi, yi, xj, yj, x, y) == 0 and _on_segment(xi, yi, xj, yj, x, y):
+            return 0
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return 1 if inside else -1
+
+# Funzione che verifica se un punto è strettamente interno alla geometria,
+# cioè interno al contorno esterno di un poligono e non dentro i suoi buchi
+def point_strictly_inside(x, y, geometry):
+    for polygon in get_polygons(geometry):
+        if point_in_ring(x, y, polygon[0]) != 1:
+            continue
+        if all(point_in_ring(x, y, hole) == -1 for hole in polygon[1:]):
+            return True
+    return False
+
+# Funzione che restituisce un punto sicuramente interno al poligono (e non nei
+# suoi buchi). Viene scelta una retta orizzontale che non passa per nessun
+# vertice, a metà tra due y consecutive dei vertici vicino alla mediana: i
+# punti in cui la retta attraversa gli anelli, ordinati, delimitano a coppie
+# tratti interni al poligono e viene restituito il centro del tratto più lungo.
+def interior_point(polygon):
+    ys = sorted({coord[1] for ring in polygon for coord in ring})
+    if len(ys) < 2:
+        return None
+    middle = len(ys) // 2
+    y = (ys[middle - 1] + ys[middle]) / 2
+    crossings = []
+    for ring in polygon:
+        for x1, y1, x2, y2 in ring_to_segments(ring):
+            if (y1 > y) != (y2 > y):
+                crossings.append(x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+    crossings.sort()
+    spans = [(crossings[i + 1] - crossings[i], crossings[i], crossings[i + 1]) for i in range(0, len(crossings) - 1, 2)]
+    if not spans:
+        return None
+    _, x1, x2 = max(spans)
+    return (x1 + x2) / 2, y
+
+# Funzione che restituisce i punti di prova di una geometria usati per
+# verificare il contenimento: vertici, punti medi dei lati e un punto interno
+# di ogni poligono. Il punto interno serve per aree uguali o che condividono
+# tutto il bordo (es. la stessa area disegnata due volte), per le quali tutti
+# gli altri punti di prova cadono sul bordo dell'altra area.
+def _probe_points(geometry):
+    for polygon in get_polygons(geometry):
+        for x1, y1, x2, y2 in ring_to_segments(polygon[0]):
+            yield x1, y1
+            yield (x1 + x2) / 2, (y1 + y2) / 2
+        point = interior_point(polygon)
+        if point is not None:
+            yield point
+
+# Funzione che verifica se due aree si sovrappongono. Due aree che condividono
+# solo un lato o un vertice (adiacenti) non sono considerate sovrapposte.
+# Le aree si sovrappongono se i loro bordi si attraversano oppure se una
+# contiene un punto interno dell'altra.
+def geometries_overlap(geometry_a, geometry_b):
+    segments = []
+    for owner, geometry in enumerate((geometry_a, geometry_b)):
+        for polygon in get_polygons(geometry):
+            for ring in polygon:
+                segments.extend((*segment, owner) for segment in ring_to_segments(ring))
+
+    for i, j in sweep_candidate_pairs([_segment_box(segment) for segment in segments]):
+        if segments[i][4] != segments[j][4] and segments_intersect(segments[i], segments[j], proper=True):
+            return True
+
+    return (any(point_strictly_inside(x, y, geometry_b) for x, y in _probe_points(geometry_a)) or
+            any(point_strictly_inside(x, y, geometry_a) for x, y in _probe_points(geometry_b)))
+
+# Funzione principale di validazione della lista di aree. Restituisce un
+# dizionario con gli indici delle aree che si autointersecano e le coppie di
+# indici delle aree che si sovrappongono. Le coppie candidate vengono trovate
+# con la sweep line sui bounding box delle aree (indice spaziale) invece di
+# confrontare tutte le coppie, e solo queste vengono verificate esattamente.
+# Il dizionario contiene anche il bounding box di ogni area ('boxes'), usato
+# da validate_appended per validare solo le aree aggiunte.
+def validate_drawings(drawings):
+    self_intersections = []
+    all_boxes = []
+    boxes = []
+    indexes = []
+    for index, drawing in enumerate(drawings):
+        geometry = drawing['geometry']
+        bbox = geometry_bbox(geometry)
+        all_boxes.append(bbox)
+        if bbox is None:
+            continue
+        if is_self_intersecting(geometry):
+            self_intersections.append(index)
+        boxes.append(bbox)
+        indexes.append(index)
+
+    overlaps = []
+    for i, j in sweep_candidate_pairs(boxes):
+        a, b = sorted((indexes[i], indexes[j]))
+        if geometries_overlap(drawings[a]['geometry'], drawings[b]['geometry']):
+            overlaps.append((a, b))
+    overlaps.sort()
+
+    invalid = set(self_intersections)
+    for a, b in overlaps:
+        invalid.update((a, b))
+
+    return {
+        'self_intersections': self_intersections,
+        'overlaps': overlaps,
+        'invalid': invalid,
+        'boxes': all_boxes,
+    }
+
+# Funzione che aggiorna sul posto il risultato della validazione dopo una
+# modifica della lista di aree senza rivalidare le aree non cambiate.
+# positions indica per ogni indice della lista precedente il nuovo indice
+# dell'area (None se è stata rimossa); dirty contiene i nuovi indici delle aree
+# aggiunte o modificate. I risultati delle aree non cambiate vengono solo
+# rinumerati, mentre le aree in dirty vengono verificate esattamente contro le
+# aree il cui bounding box si sovrappone al loro (ricerca vettorizzata sui
+# bounding box di tutte le aree).
+def validate_changes(drawings, validation, positions, dirty):
+    dirty = set(dirty)
+    boxes = [None] * len(drawings)
+    for old_index, new_index in enumerate(positions):
+        if new_index is not None:
+            boxes[new_index] = validation['boxes'][old_index]
+    for index in dirty:
+        boxes[index] = geometry_bbox(drawings[index]['geometry'])
+
+    def kept(old_index):
+        return positions[old_index] is not None and positions[old_index] not in dirty
+
+    self_intersections = [positions[i] for i in validation['self_intersections'] if kept(i)]
+    overlaps = [(positions[a], positions[b]) for a, b in validation['overlaps'] if kept(a) and kept(b)]
+
+    box_array = np.array([box if box is not None else (np.nan,) * 4 for box in boxes], dtype=float).reshape(-1, 4)
+    for index in sorted(dirty):
+        bbox = boxes[index]
+        if bbox is None:
+            continue
+        geometry = drawings[index]['geometry']
+        if is_self_intersecting(geometry):
+            self_intersections.append(index)
+        min_x, min_y, max_x, max_y = bbox
+        candidates = np.flatnonzero((box_array[:, 0] <= max_x) & (box_array[:, 2] >= min_x) &
+                                    (box_array[:, 1] <= max_y) & (box_array[:, 3] >= min_y))
+        for other in candidates.tolist():
+            # Le coppie di aree entrambe in dirty vengono verificate una sola volta
+            if other == index or (other in dirty and other > index):
+                continue
+            if geometries_overlap(drawings[other]['geometry'], geometry):
+                overlaps.append((min(other, index), max(other, index)))
+
+    self_intersections.sort()
+    overlaps.sort()
+    invalid = set(self_intersections)
+    for a, b in overlaps:
+        invalid.update((a, b))
+    validation.update({
+        'self_intersections': self_intersections,
+        'overlaps': overlaps,
+        'invalid': invalid,
+        'boxes': boxes,
+    })
+    return validation
+
+# Funzione che aggiorna sul posto il risultato della validazione quando
+# vengono aggiunte aree in fondo alla lista (dall'indice start in poi).
+def validate_appended(drawings, validation, start):
+    return validate_changes(drawings, validation, list(range(start)), range(start, len(drawings)))
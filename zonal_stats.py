@@ -0,0 +1,159 @@
+import numpy as np
+from rasterio.features import rasterize
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+from pyproj import CRS
+from geometry_engine import WGS84, reproject, flatten_features, metric_resolution
+
+# ============ STATISTICHE ZONALI PER AREA ===============
+
+# CRS delle immagini statiche di MapBox (Web Mercator)
+WEB_MERCATOR = "EPSG:3857"
+# Numero di intervalli degli istogrammi della luminosità
+HISTOGRAM_BINS = 16
+
+# Funzione che riproietta le geometrie delle features nel CRS del raster con
+# una sola chiamata vettorizzata e le ricostruisce come MultiPolygon
+# (un anello esterno inizia un nuovo poligono, i successivi sono i suoi buchi)
+def reproject_geometries(features, src_crs, dst_crs):
+    flat = flatten_features(features)
+    xs, ys = reproject(flat['x'], flat['y'], src_crs, dst_crs)
+    polygons = [[] for _ in features]
+    for start, length, feature_index, exterior in zip(flat['ring_start'], flat['ring_length'],
+                                                      flat['ring_feature'], flat['ring_exterior']):
+        ring = np.column_stack((xs[start:start + length], ys[start:start + length])).tolist()
+        if exterior or not polygons[feature_index]:
+            polygons[feature_index].append([ring])
+        else:
+            polygons[feature_index][-1].append(ring)
+    return [{'type': 'MultiPolygon', 'coordinates': feature_polygons} for feature_polygons in polygons]
+
+# Funzione che restituisce la trasformazione affine (pixel -> Web Mercator)
+# dell'immagine statica di MapBox ottenuta da un bounding box in WGS84.
+# MapBox centra il bounding box nell'immagine e sceglie la scala più grande
+# che lo contiene tutto, quindi su un asse l'immagine può coprire un'area
+# più ampia del bounding box.
+def mapbox_transform(bbox, width, height):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    xs, ys = reproject(np.array([min_lon, max_lon]), np.array([min_lat, max_lat]), WGS84, WEB_MERCATOR)
+    meters_per_pixel = max((xs[1] - xs[0]) / width, (ys[1] - ys[0]) / height)
+    center_x, center_y = (xs[0] + xs[1]) / 2, (ys[0] + ys[1]) / 2
+    west = center_x - width / 2 * meters_per_pixel
+    north = center_y + height / 2 * meters_per_pixel
+    return from_origin(west, north, meters_per_pixel, meters_per_pixel)
+
+# Funzione che restituisce la risoluzione al suolo (metri per pixel in
+# latitudine e longitudine) e l'area al suolo di un pixel di un raster in Web
+# Mercator alla latitudine indicata. La proiezione è conforme, quindi la scala
+# (1 / cos(latitudine)) è la stessa sui due assi.
+def mercator_ground_resolution(transform, latitude):
+    scale = np.cos(np.radians(latitude))
+    resolution_lon = abs(transform.a) * scale
+    resolution_lat = abs(transform.e) * scale
+    return resolution_lat, resolution_lon, resolution_lat * resolution_lon
+
+# Funzione che restituisce l'area al suolo (m²) di un pixel di un raster.
+# In un CRS proiettato è esattamente |a * e| della trasformazione (convertita
+# in metri se il CRS usa un'altra unità, es. piedi); in un CRS geografico
+# viene approssimata con le distanze geodetiche del bounding box del raster.
+def raster_pixel_area(transform, raster_crs, width, height):
+    crs = CRS.from_user_input(raster_crs)
+    if not crs.is_geographic:
+        to_meters = crs.axis_info[0].unit_conversion_factor if crs.axis_info else 1.0
+        return abs(transform.a * transform.e) * to_meters ** 2
+    west, north = transform * (0, 0)
+    east, south = transform * (width, height)
+    lon, lat = reproject(np.array([west, east]), np.array([south, north]), raster_crs, WGS84)
+    _, _, pixel_area = metric_resolution((lon.min(), lat.min(), lon.max(), lat.max()), width, height)
+    return pixel_area
+
+# Funzione che legge un GeoTIFF dai byte del file caricato e restituisce
+# l'immagine RGB (altezza, larghezza, 3), la trasformazione affine e il CRS.
+# Con una sola banda l'immagine viene trattata come scala di grigi.
+# I pixel senza dato (nodata o maschera del file) valgono NaN.
+# Solleva ValueError se il GeoTIFF non ha un CRS.
+def read_geotiff(file_bytes):
+    with MemoryFile(file_bytes) as memory_file:
+        with memory_file.open() as dataset:
+            if dataset.crs is None:
+                raise ValueError("Il GeoTIFF non ha un sistema di riferimento (CRS).")
+            bands = dataset.read(indexes=[1, 2, 3] if dataset.count >= 3 else [1, 1, 1], masked=True)
+            rgb = np.moveaxis(bands.astype(float).filled(np.nan), 0, -1)
+            return rgb, dataset.transform, dataset.crs.to_string()
+
+# Funzione che rasterizza tutte le aree in una sola passata in un'immagine di
+# etichette: il pixel vale i + 1 se appartiene all'area i, 0 se è fuori da
+# tutte le aree. Se due aree si sovrappongono il pixel va all'ultima.
+def rasterize_labels(geometries, shape, transform):
+    shapes = [(geometry, index + 1) for index, geometry in enumerate(geometries) if geometry['coordinates']]
+    if not shapes:
+        return np.zeros(shape, dtype=np.int32)
+    return rasterize(shapes, out_shape=shape, transform=transform, fill=0, dtype='int32')
+
+# Funzione che calcola tutte le statistiche per area con riduzioni raggruppate
+# (np.bincount) sull'immagine di etichette, invece di una maschera per ogni area.
+# Restituisce, per ogni area: numero di pixel, area in m², media R, G, B,
+# luminosità media (come la conversione in bianco e nero di PIL), indice
+# ExG medio (Excess Green, 2g - r - b sui valori normalizzati) e istogramma
+# della luminosità.
+# I pixel senza dato (NaN) contano per l'area ma sono esclusi da medie e
+# istogrammi: il numero di pixel usati per le medie è in 'valid_count'.
+def zonal_statistics(labels, rgb, n_features, pixel_area, bins=HISTOGRAM_BINS):
+    labels = labels.ravel()
+    pixels = rgb.reshape(-1, 3).astype(float)
+    n_labels = n_features + 1
+
+    counts = np.bincount(labels, minlength=n_labels)
+    # I pixel senza dato vengono assegnati allo sfondo per le altre statistiche
+    valid = ~np.isnan(pixels).any(axis=1)
+    if not valid.all():
+        labels = np.where(valid, labels, 0)
+        pixels = np.where(valid[:, None], pixels, 0.0)
+    valid_counts = np.bincount(labels, minlength=n_labels)
+    sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=n_labels) for c in range(3)], axis=1)
+
+    luminance = pixels @ np.array([0.299, 0.587, 0.114])
+    total = pixels.sum(axis=1)
+    chroma = np.divide(pixels, total[:, None], out=np.zeros_like(pixels), where=total[:, None] > 0)
+    exg = 2 * chroma[:, 1] - chroma[:, 0] - chroma[:, 2]
+
+    # Istogramma di ogni area con un solo bincount sulla coppia (etichetta, intervallo)
+    max_value = max(float(luminance.max()), 1.0) if len(luminance) else 1.0
+    bin_index = np.minimum((luminance / max_value * bins).astype(np.int64), bins - 1)
+    histograms = np.bincount(labels * bins + bin_index, minlength=n_labels * bins).reshape(n_labels, bins)
+
+    # Si escludono i pixel di sfondo (etichetta 0)
+    return {
+        'count': counts[1:],
+        'valid_count': valid_counts[1:],
+        'area': counts[1:] * pixel_area,
+        'rgb_sum': sums[1:],
+        'luminance_sum': np.bincount(labels, weights=luminance, minlength=n_labels)[1:],
+        'exg_sum': np.bincount(labels, weights=exg, minlength=n_labels)[1:],
+        'histogram': histograms[1:],
+    }
+
+# Funzione che aggrega le statistiche delle aree per classe (nome dell'area).
+# Dato che ogni pixel appartiene a una sola area, le somme per classe sono le
+# somme delle somme delle aree della classe.
+def class_statistics(stats, names):
+    classes, codes = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+    grouped = {'classes': classes}
+    for key, values in stats.items():
+        if values.ndim == 1:
+            grouped[key] = np.bincount(codes, weights=values, minlength=len(classes))
+        else:
+            grouped[key] = np.stack([np.bincount(codes, weights=values[:, c], minlength=len(classes))
+                                     for c in range(values.shape[1])], axis=1)
+    return grouped
+
+# Funzione che calcola le medie a partire dalle somme, lasciando NaN per
+# le aree senza pixel validi (ad esempio aree più piccole di un pixel)
+def statistics_means(stats):
+    counts = stats['valid_count'].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'rgb': stats['rgb_sum'] / counts[:, None],
+            'luminance': stats['luminance_sum'] / counts,
+            'exg': stats['exg_sum'] / counts,
+        }